@@ -1,23 +1,24 @@
-import xml.etree.cElementTree as ET
 from pprint import pprint
 from pprint import pformat
+from parse_cache import ParseCache
 
-# Load XML data
-tree = ET.parse("./input/singapore.osm")
-
-
-def count_tag(tree):
-    """
-    Count number of tags in xml.
-    """
-    tags = {}
-    for e in tree.iter():
-        if e.tag not in tags:
-            tags[e.tag] = 1
-        else:
-            tags[e.tag] += 1
-    return tags
-pprint(count_tag(tree))
+OSM_FILE = "./input/singapore.osm"
+
+# Profile XML data in a single streaming pass,
+# split into shards parsed by a pool of processes (one per CPU).
+# The profile is cached next to the file and reused until the file changes.
+# The whole DOM does not fit in memory for larger extracts, so every result
+# is taken from the profile and the tag store instead of a parsed tree.
+cache = ParseCache(OSM_FILE)
+profile = cache.profile()
+# Keys, values and users of */tag encoded as integer codes, indexed by
+# (parent, key) so count_k and count_v below read only the matching tags.
+# Built in the same sharded pass as the profile.
+tag_store = cache.tag_store()
+
+
+# Count number of tags in xml
+pprint(dict(profile.tags))
 #    {'bounds': 1,
 #     'member': 69885,
 #     'nd': 1146529,
@@ -28,28 +29,8 @@ pprint(count_tag(tree))
 #     'way': 139814}
 
 
-def check_structure(parent, element):
-    """
-    Recursively drill down an element passed and count all elements under the element.
-    
-    Args:
-        parent: A list [int, dict] which indicates parent element count and child elements.
-        element: An Element object of xml to be checked.
-    Yields:
-        A hierarchical list [int, dict] which expresses structure of the element.
-        Note, the result will be directly reflected in "parent".
-    """
-    if parent[1].has_key(element.tag):
-        parent[1][element.tag][0] += 1
-    else:
-        parent[1][element.tag] = [1, {}]
-    for child in element:
-        # Recursive call for children
-        check_structure(parent[1][element.tag], child)
-
 # Check structure of xml
-structure = [1, {}]
-check_structure(structure, tree.getroot())
+structure = profile.structure
 pprint(structure)
 #{'osm': [1,
 #         {'bounds': [1, {}],
@@ -71,26 +52,15 @@ TAGS = ["bounds",
 
 
 # Root tags 'osm'
-pprint(tree.getroot().attrib)
+pprint(profile.root_attrib)
 #    {'generator': 'osmconvert 0.7T',
 #     'timestamp': '2016-01-09T00:27:02Z',
 #     'version': '0.6'}
 
-def count_attributes(tree, tag):
-    """
-    Count total number of attributes in tag.
-    """
-    attributes = {}
-    for element in tree.findall(tag):
-        for attr in element.attrib.keys():
-            if attr not in attributes:
-                attributes[attr] = 1
-            else:
-                attributes[attr] += 1
-    return attributes
+# Count total number of attributes in each tag
 for tag in TAGS:
     print tag
-    pprint(count_attributes(tree, tag))
+    pprint(profile.count_attributes(tag))
     print ""
 #    bounds
 #    {'maxlat': 1, 'maxlon': 1, 'minlat': 1, 'minlon': 1}
@@ -138,65 +108,27 @@ for tag in TAGS:
 
 
 
-def show_samples(tree, tags, n):
-    """
-    Show n sample elements of specified tags.
-    """
-    for tag in tags:
-        print tag
-        for element in tree.findall(tag)[:n]:
-            pprint(element.attrib)
-        print ""
-show_samples(tree, TAGS, 3)
-
-
-def count_k(tag_elements):
-    """
-    Count value of "k(ey)" attribute in "*/tag" element.
-    
-    Args:
-        tag_elements: */tag elements which have "k" attribute.
-    Return:
-        A list of tupples (count, k) in descending order of count.
-    """
-    count = {}
-    for element in tag_elements:
-        if count.has_key(element.get("k")):
-            count[element.get("k")] += 1
-        else:
-            count[element.get("k")] = 1
-    return sorted([(cnt, k) for (k, cnt) in count.items()], reverse=True)
+# Show 3 sample elements of each tag
+for tag in TAGS:
+    print tag
+    for attrib in profile.samples[tag]:
+        pprint(attrib)
+    print ""
+
+
 # Count value of k(ey) in "*/tag"
 with open('./output/node-tag.txt', 'w') as f:
-    f.write(pformat(count_k(tree.findall("node/tag"))))
+    f.write(pformat(tag_store.count_k("node/tag")))
 with open('./output/relation-tag.txt', 'w') as f:
-    f.write(pformat(count_k(tree.findall("relation/tag"))))
+    f.write(pformat(tag_store.count_k("relation/tag")))
 with open('./output/way-tag.txt', 'w') as f:
-    f.write(pformat(count_k(tree.findall("way/tag"))))
-
-
-def count_v(tag_elements):
-    """
-    Count value of "v(alue)" attribute in "*/tag" element.
-    
-    Args:
-        tag_elements: */tag elements which have "v" attribute.
-    Return:
-        A list of tupples (count, k) in descending order of count.
-    """
-    count = {}
-    for element in tag_elements:
-        if count.has_key(element.get("v")):
-            count[element.get("v")] += 1
-        else:
-            count[element.get("v")] = 1
-    return sorted([(cnt, v) for (v, cnt) in count.items()], reverse=True)
-    # Sorted by "v(alue)"
-    #return sorted([(v, cnt) for (v, cnt) in count.items()])
+    f.write(pformat(tag_store.count_k("way/tag")))
+
 
+# Count value of v(alue) in "*/tag" in descending order of count
 # Check some "v(alue)" in "node/tag"
 with open('./output/node-tag@name.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("node/tag[@k='name']"))))
+    f.write(pformat(tag_store.count_v("node/tag", "name")))
 # [Problem 1] Words do not start with capital latter
 #    Every word should starts with capital letter
 # [Problem 2] Abbrebiation of common words
@@ -212,15 +144,15 @@ with open('./output/node-tag@name.txt', 'w') as f:
 #    Pizza Hut
 
 with open('./output/node-tag@highway.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("node/tag[@k='highway']"))))
+    f.write(pformat(tag_store.count_v("node/tag", "highway")))
 with open('./output/node-tag@location.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("node/tag[@k='location']"))))
+    f.write(pformat(tag_store.count_v("node/tag", "location")))
 with open('./output/node-tag@amenity.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("node/tag[@k='amenity']"))))
+    f.write(pformat(tag_store.count_v("node/tag", "amenity")))
 with open('./output/node-tag@street.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("node/tag[@k='addr:street']"))))
+    f.write(pformat(tag_store.count_v("node/tag", "addr:street")))
 with open('./output/node-tag@postcode.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("node/tag[@k='addr:postcode']"))))
+    f.write(pformat(tag_store.count_v("node/tag", "addr:postcode")))
 # [Problem 1] Alphabets are included
 #    'S118556'
 #    'S120517'
@@ -233,20 +165,20 @@ with open('./output/node-tag@postcode.txt', 'w') as f:
 
 # Check some "v(alue)" in "relation/tag"
 with open('./output/relation-tag@type.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("relation/tag[@k='type']"))))
+    f.write(pformat(tag_store.count_v("relation/tag", "type")))
 with open('./output/relation-tag@name.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("relation/tag[@k='name']"))))
+    f.write(pformat(tag_store.count_v("relation/tag", "name")))
 with open('./output/relation-tag@route.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("relation/tag[@k='route']"))))
+    f.write(pformat(tag_store.count_v("relation/tag", "route")))
 
 
 # Check some "v(alue)" in "way/tag"
 with open('./output/way-tag@highway.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("way/tag[@k='highway']"))))
+    f.write(pformat(tag_store.count_v("way/tag", "highway")))
 with open('./output/way-tag@name.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("way/tag[@k='name']"))))
+    f.write(pformat(tag_store.count_v("way/tag", "name")))
 with open('./output/way-tag@postcode.txt', 'w') as f:
-    f.write(pformat(count_v(tree.findall("way/tag[@k='addr:postcode']"))))
+    f.write(pformat(tag_store.count_v("way/tag", "addr:postcode")))
 # [Problems 1~3] Same as above
 
 
@@ -1,76 +1,35 @@
-from datetime import datetime
-import json
-from bson import json_util
+from pprint import pformat
+from osm_json import records_from_file, write_json_lines
+from osm_stream import open_osm_input
+from stage_profile import PROFILER, count_result, profiled
 
-def convert_xml_2_json(tree, filename):
+@profiled(count=count_result)
+def convert_osm_2_json(osm_file, filename, converter=None):
     """
-    Converts xml to json file.
+    Converts an OSM XML file to JSON Lines file (one compact record per line).
     A field "xml" is added to record tag name.
+    Streams over the file with iterparse, and each element is shaped in a
+    single visit of its children and written as soon as it is shaped,
+    so neither the tree nor the output is ever held in memory.
     
     Args:
-        tree: An ElementTree object.
-        filename: A JSON file name outputted.
+        osm_file: A file name or file object of OSM XML.
+        filename: A JSON Lines file name outputted. Ends with ".gz" to compress.
+        converter: A DtypeConverter object converting attribute values.
     Yields:
-        A JSON file.
+        A JSON Lines file.
+    Returns:
+        Number of records written.
     """
-    with open("./input/" + filename, "w") as f:
-        # Start of JSON file
-        f.write("[\n")
-        
-        # Convert the root element
-        root = tree.getroot().attrib.copy()
-        root["timestamp"] = datetime.strptime(root["timestamp"], '%Y-%m-%dT%H:%M:%SZ')
-        root["xml"] = tree.getroot().tag
-        json.dump(root, f, default=json_util.default, indent=4)
-        
-        # Convert all elements under the root
-        for parent in tree.getroot():
-            record = parent.attrib.copy()
-            record["xml"] = parent.tag
-            if parent.iter():
-                if parent.tag == "node":
-                    # "node/tag"
-                    if parent.findall("tag"):
-                        record["tag"] = []
-                        for child in parent.findall("tag"):
-                            record["tag"].append(child.attrib)
-                
-                elif parent.tag == "relation":
-                    # "relation/tag"
-                    if parent.findall("tag"):
-                        record["tag"] = []
-                        for child in parent.findall("tag"):
-                            record["tag"].append(child.attrib)
-                    # "relation/member"
-                    if parent.findall("member"):
-                        record["member"] = []
-                        for child in parent.findall("member"):
-                            record["member"].append(child.attrib)
-                    
-                elif parent.tag == "way":
-                    # "way/nd"
-                    if parent.findall("nd"):
-                        record["nd"] = []
-                        for child in parent.findall("nd"):
-                            record["nd"].append(child.get("ref"))
-                    # "way/tag"
-                    if parent.findall("tag"):
-                        record["tag"] = []
-                        for child in parent.findall("tag"):
-                            record["tag"].append(child.attrib)
-                    
-                elif parent.tag == "bounds":
-                    # bounds element does not have any child
-                    None
-                else:
-                    print "[Error] Unexpected tag :", parent.tag
-            # Write a record
-            f.write(", \n")
-            json.dump(record, f, default=json_util.default, indent=4)
-        # End of JSON file
-        f.write("\n]")
-        
-# Convert xml to json
-convert_xml_2_json(tree, "singapore.json")
+    return write_json_lines(records_from_file(osm_file, converter), "./input/" + filename)
 
+# Convert xml to json with data types of DTYPE
+# from the extract cleaned in 2_check_clean.py
+with open_osm_input(CLEAN_FILE) as f:
+    convert_osm_2_json(f, "singapore.jsonl", dtype_converter)
+with open('./output/dtype-errors.txt', 'w') as f:
+    f.write(pformat(dtype_converter.errors))
+print "Conversion errors:", len(dtype_converter.errors)
 
+# Time of each stage of the whole run (STAGE_PROFILE=cprofile,memory for more)
+print PROFILER.report('./output/stage-profile.txt')
@@ -1,6 +1,7 @@
 from pymongo import MongoClient
-import json
-from bson import json_util
+from osm_json import read_json_lines
+from mongo_load import load_records, build_indexes
+from parse_cache import ParseCache
 from pprint import pprint
 from pprint import pformat
 from pandas import DataFrame
@@ -8,15 +9,19 @@ import calendar
 import seaborn as sns
 from mpl_toolkits.basemap import Basemap
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
+import numpy as np
 
 # Connect to "singapore" collection in "map" database
 mp = MongoClient('localhost:27017').map
 sg = mp.singapore
 # Clear data in singapore
 mp.drop_collection("singapore")
-# Import JSON file to "singapore" collection
-with open("./input/singapore.json", "r") as f:
-    sg.insert_many(json.load(f, object_hook=json_util.object_hook))
+# Import JSON Lines file to "singapore" collection
+# (streamed in batches by a pool of threads, indexes are built after loading)
+pprint(load_records(sg, read_json_lines("./input/singapore.jsonl"), \
+                    batch_size=1000, workers=4))
+build_indexes(sg)
 
 
 # Show sample records
@@ -139,9 +144,13 @@ bounds = sg.find_one({"xml" : "bounds"})
 # Create ajustment terms for the map coordinate
 lon_ajst = (bounds["maxlon"] - bounds["minlon"]) / 3
 lat_ajst = (bounds["maxlat"] - bounds["minlat"]) / 3
-# Get longitude and latitude from node tags
-node = DataFrame(list(sg.aggregate([{"$match" : {"xml" : "node"}}, \
-                                    {"$project" : {"lat" : 1, "lon" : 1}}])))
+# Node counts per cell of a grid index over the columnar node store
+# cached by 2_check_clean.py (no need to pull every node from db)
+osm_cache = ParseCache("./input/singapore.osm")
+node_store = osm_cache.node_store()
+grid = osm_cache.grid_index(cell_size=0.005)
+counts, lat_edges, lon_edges = grid.density()
+counts = np.ma.masked_equal(counts, 0)
 
 plt.figure(figsize=(12, 8))
 m = Basemap(projection='merc', resolution="f", 
@@ -150,13 +159,25 @@ m = Basemap(projection='merc', resolution="f",
 m.drawcoastlines()
 #m.drawcountries()
 m.fillcontinents(color='burlywood')
-xpt, ypt = m(list(node["lon"]), list(node["lat"]))
-m.plot(xpt, ypt, 'g.', alpha=0.01)
+xpt, ypt = m(*np.meshgrid(lon_edges, lat_edges))
+m.pcolormesh(xpt, ypt, counts, cmap="Greens", norm=LogNorm(), alpha=0.8)
 plt.show()
 # [Reference] https://github.com/BillMills/python-mapping
 
-# Jointplot of location
-sns.jointplot(x="lon", y="lat", data=node, kind="kde", space=0, color="g", size=8, \
-              xlim=(bounds["minlon"]+lon_ajst, bounds["maxlon"]-lon_ajst), \
-              ylim=(bounds["minlat"]+lat_ajst, bounds["maxlat"]-lat_ajst))
-# [Reference] http://stackoverflow.com/questions/23969619/plotting-with-seaborn-using-the-matplotlib-object-oriented-interface
+# Density of location (node count per cell in log scale)
+plt.figure(figsize=(8, 8))
+plt.pcolormesh(lon_edges, lat_edges, counts, cmap="Greens", norm=LogNorm())
+plt.xlim(bounds["minlon"]+lon_ajst, bounds["maxlon"]-lon_ajst)
+plt.ylim(bounds["minlat"]+lat_ajst, bounds["maxlat"]-lat_ajst)
+plt.colorbar()
+plt.show()
+
+# Nodes within 500m of a point (National University of Singapore)
+near = grid.radius(1.2966, 103.7764, 500)
+len(near)
+pprint(list(sg.find({"xml" : "node", "id" : {"$in" : [int(i) for i in node_store.id[near[:5]]]}})))
+
+# Geometry of ways (way/nd refs joined with node coordinates)
+ways = osm_cache.way_store()
+print "Total length of ways (km):", ways.length.sum() / 1000
+pprint(ways.geometry(int(ways.length.argmax()))[:5])
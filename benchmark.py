@@ -0,0 +1,448 @@
+"""
+Benchmarks of the explore / clean / export steps on synthetic OSM data.
+
+A synthetic OSM XML file is generated with element counts and tag
+distributions modelled on the Singapore extract (see 1_explore.py and
+output/*-tag.txt), scaled by --scale. Each step runs in its own process,
+and wall time, throughput and peak RSS are written to a JSON file which
+can be compared with a previous run. Setup (e.g. parsing the tree a
+cleaner works on) runs in the same process, so the growth of peak RSS
+during the step alone is reported as well.
+
+Usage:
+    python benchmark.py --scale 0.1 --output ./output/benchmark.json
+    python benchmark.py --compare ./output/benchmark.json
+"""
+from __future__ import division
+import argparse
+import ast
+import json
+from multiprocessing import Pipe, Process
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import xml.etree.cElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Counts in the Singapore extract
+SINGAPORE = {"node": 931707, "way": 139814, "relation": 1762,
+             "node/tag": 80464, "way/nd": 1146529, "way/tag": 375303,
+             "relation/member": 69885, "relation/tag": 6191}
+
+# Relative frequency of "k(ey)" per parent (top keys of output/*-tag.txt)
+NODE_KEYS = [("name", 12334), ("highway", 7745), ("created_by", 7369),
+             ("location", 4888), ("asset_ref", 4887), ("route_ref", 4834),
+             ("amenity", 4789), ("source", 3889), ("power", 1612),
+             ("addr:housenumber", 1434), ("addr:street", 1185),
+             ("ref", 1104), ("place", 926), ("addr:postcode", 905)]
+WAY_KEYS = [("highway", 64950), ("building", 59631), ("name", 41893),
+            ("source", 33067), ("addr:street", 22520), ("addr:housenumber", 17642),
+            ("addr:city", 17060), ("oneway", 14224), ("addr:postcode", 13419),
+            ("addr:country", 9524)]
+RELATION_KEYS = [("type", 1757), ("name", 894), ("route", 469), ("ref", 456),
+                 ("network", 405), ("building", 287), ("restriction", 170)]
+
+# Values repeat heavily like in output/node-tag@name.txt
+NAMES = ["McDonald's", "mcdonalds", "ERP", "NTUC Fairprice", "7-Eleven", "seven eleven",
+         "7 11", "KFC", "starbucks coffee", "Starbucks", "mos burger", "Pizza Hut",
+         "blk 23", "Blk 102 opp carpark", "opp bus stop", "bef jurong east", "aft clementi",
+         "Bus Stop", "orchard road", "Marina Bay", "the Cathay", "block of flats"]
+HIGHWAYS = ["residential", "service", "footway", "bus_stop", "traffic_signals",
+            "primary", "secondary", "tertiary", "crossing", "steps"]
+STREETS = ["Orchard Road", "Jurong West St. 42", "Ang Mo Kio Ave 3", "Bukit Timah Rd.",
+           "Clementi Ave 2", "Tampines St 81"]
+USERS = [("JaLooNz", 274590), ("berjaya", 1318), ("rene78", 41472), ("Luis36995", 2000000),
+         ("cboothroyd", 2413), ("Sihabul Milah", 2400000), ("yurasi", 3000000)]
+
+
+def _postcode(rnd):
+    """
+    Mostly valid six digit codes, some with letters or invalid districts.
+    """
+    r = rnd.random()
+    if r < 0.05:
+        return "S%06d" % rnd.randint(10000, 829999)
+    if r < 0.08:
+        return "Singapore %06d" % rnd.randint(10000, 829999)
+    if r < 0.12:
+        return "%d" % rnd.randint(1000, 99999)
+    return "%06d" % rnd.randint(10000, 829999)
+
+
+def _value(rnd, k):
+    if k == "name":
+        return rnd.choice(NAMES)
+    if k == "highway":
+        return rnd.choice(HIGHWAYS)
+    if k == "addr:street":
+        return rnd.choice(STREETS)
+    if k == "addr:postcode":
+        return _postcode(rnd)
+    if k in ("addr:housenumber", "ref", "asset_ref"):
+        return str(rnd.randint(1, 999))
+    return "%s_%d" % (k.split(":")[-1], rnd.randint(0, 20))
+
+
+def _weighted_keys(rnd, keys, n):
+    total = sum(w for _, w in keys)
+    chosen = []
+    for _ in xrange(n):
+        r = rnd.uniform(0, total)
+        for k, w in keys:
+            r -= w
+            if r <= 0:
+                break
+        if k not in chosen:
+            chosen.append(k)
+    return chosen
+
+
+def _tag_count(rnd, mean):
+    """
+    Number of tags of an element: 0 mostly for small means, around mean otherwise.
+    """
+    n = int(mean)
+    return n + (1 if rnd.random() < mean - n else 0)
+
+
+def _attrs(rnd, tag, id_):
+    user, uid = rnd.choice(USERS)
+    return ' id="%d" version="%d" changeset="%d" user=%s uid="%d" timestamp="%04d-%02d-%02dT%02d:%02d:%02dZ"' % (
+        id_, rnd.randint(1, 9), rnd.randint(1, 36000000), quoteattr(user), uid,
+        rnd.randint(2007, 2015), rnd.randint(1, 12), rnd.randint(1, 28),
+        rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59))
+
+
+def _write_tags(f, rnd, keys, n):
+    for k in _weighted_keys(rnd, keys, n):
+        f.write('\t\t<tag k=%s v=%s/>\n' % (quoteattr(k), quoteattr(_value(rnd, k))))
+
+
+def generate_osm(filename, nodes, ways, relations, seed=0):
+    """
+    Writes a synthetic OSM XML file.
+
+    Args:
+        filename: A file name outputted.
+        nodes, ways, relations: Number of each element.
+        seed: Seed of the random values.
+    """
+    rnd = random.Random(seed)
+    node_tags = SINGAPORE["node/tag"] / SINGAPORE["node"]
+    way_nds = SINGAPORE["way/nd"] / SINGAPORE["way"]
+    way_tags = SINGAPORE["way/tag"] / SINGAPORE["way"]
+    members = SINGAPORE["relation/member"] / SINGAPORE["relation"]
+    relation_tags = SINGAPORE["relation/tag"] / SINGAPORE["relation"]
+    with open(filename, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<osm version="0.6" generator="benchmark.py" timestamp="2016-01-09T00:27:02Z">\n')
+        f.write('\t<bounds minlat="1.1235" minlon="103.6" maxlat="1.4809" maxlon="104.1"/>\n')
+        for i in xrange(1, nodes + 1):
+            f.write('\t<node%s lat="%.7f" lon="%.7f"' % (_attrs(rnd, "node", i),
+                                                       rnd.uniform(1.2, 1.47),
+                                                       rnd.uniform(103.6, 104.05)))
+            # Tags are concentrated in few nodes like in the extract
+            n = _tag_count(rnd, node_tags * 10) if rnd.random() < 0.1 else 0
+            if n:
+                f.write('>\n')
+                _write_tags(f, rnd, NODE_KEYS, n)
+                f.write('\t</node>\n')
+            else:
+                f.write('/>\n')
+        for i in xrange(1, ways + 1):
+            f.write('\t<way%s>\n' % _attrs(rnd, "way", i))
+            for _ in xrange(max(2, _tag_count(rnd, way_nds))):
+                f.write('\t\t<nd ref="%d"/>\n' % rnd.randint(1, nodes))
+            _write_tags(f, rnd, WAY_KEYS, _tag_count(rnd, way_tags))
+            f.write('\t</way>\n')
+        for i in xrange(1, relations + 1):
+            f.write('\t<relation%s>\n' % _attrs(rnd, "relation", i))
+            for _ in xrange(_tag_count(rnd, members)):
+                if rnd.random() < 0.8:
+                    f.write('\t\t<member type="way" ref="%d" role=""/>\n' % rnd.randint(1, ways))
+                else:
+                    f.write('\t\t<member type="node" ref="%d" role="stop"/>\n' % rnd.randint(1, nodes))
+            _write_tags(f, rnd, RELATION_KEYS, _tag_count(rnd, relation_tags))
+            f.write('\t</relation>\n')
+        f.write('</osm>\n')
+
+
+def load_functions(path):
+    """
+    Returns a namespace of the imports, functions and upper case constants
+    of a script, without running the rest of the script.
+    """
+    with open(path) as f:
+        module = ast.parse(f.read(), path)
+    body = [node for node in module.body
+            if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)) or
+            (isinstance(node, ast.Assign) and
+             all(isinstance(t, ast.Name) and t.id.isupper() for t in node.targets))]
+    namespace = {"__file__": path,
+                 "__name__": os.path.splitext(os.path.basename(path))[0]}
+    exec compile(ast.Module(body), path, "exec") in namespace
+    return namespace
+
+
+def _clean():
+    return load_functions(os.path.join(HERE, "2_check_clean.py"))
+
+
+def _tree(osm_file):
+    return ET.parse(osm_file)
+
+
+# Benchmarks: name -> function(osm_file) returning (setup, run).
+# setup() is not timed and returns the argument of run(arg),
+# which returns the number of elements processed.
+def bench_et_parse(osm_file):
+    return (lambda: osm_file,
+            lambda f: sum(1 for _ in _tree(f).iter()))
+
+
+def bench_profile_osm(osm_file):
+    from osm_stream import profile_osm
+
+    def run(f):
+        return sum(profile_osm(f).tags.values())
+    return (lambda: osm_file, run)
+
+
+def bench_build_tag_store(osm_file):
+    from tag_store import build_tag_store
+
+    def run(f):
+        return len(build_tag_store(f).tags["key"])
+    return (lambda: osm_file, run)
+
+
+def bench_capitalize_words(osm_file):
+    from cleaning import ValueCleaner, capitalize_words
+
+    def run(tags):
+        ValueCleaner(capitalize_words).clean(tags)
+        return len(tags)
+    return (lambda: _tree(osm_file).findall("node/tag[@k='name']"), run)
+
+
+def bench_name_rule_engine(osm_file):
+    from cleaning import NameRuleEngine, ValueCleaner, NAME_ABBREVIATIONS, NAME_FRANCHISES
+
+    def run(tags):
+        engine = NameRuleEngine(NAME_ABBREVIATIONS + NAME_FRANCHISES)
+        ValueCleaner(engine.evaluate, record=engine.record).clean(tags)
+        return len(tags)
+    return (lambda: _tree(osm_file).findall("node/tag[@k='name']"), run)
+
+
+def _postcode_tags(osm_file):
+    tree = _tree(osm_file)
+    return tree.findall("node/tag[@k='addr:postcode']") + \
+        tree.findall("way/tag[@k='addr:postcode']")
+
+
+def bench_remove_non_numeric_chars(osm_file):
+    from cleaning import ValueCleaner, remove_non_numeric_chars
+
+    def run(tags):
+        ValueCleaner(remove_non_numeric_chars).clean(tags)
+        return len(tags)
+    return (lambda: _postcode_tags(osm_file), run)
+
+
+def bench_postcode_validator(osm_file):
+    from cleaning import PostcodeValidator, POSTCODE_RULES
+
+    def run(tags):
+        is_valid = PostcodeValidator(*POSTCODE_RULES["SG"]).is_valid
+        for tag in tags:
+            is_valid(tag.get("v"))
+        return len(tags)
+    return (lambda: _postcode_tags(osm_file), run)
+
+
+def bench_dtype_converter(osm_file):
+    from cleaning import DtypeConverter
+    dtype = _clean()["DTYPE"]
+
+    def run(tree):
+        converter = DtypeConverter(dtype)
+        n = 0
+        for element in tree.getroot():
+            converter.convert(element.tag, element.attrib, element.get("id"))
+            for child in element:
+                converter.convert(element.tag + "/" + child.tag, child.attrib)
+            n += 1
+        return n
+    return (lambda: _tree(osm_file), run)
+
+
+def bench_cleaning_pipeline(osm_file):
+    from pipeline import Pipeline, cleaning_stages
+    from osm_writer import write_cleaned_osm
+
+    def run(f):
+        return write_cleaned_osm(f, f + ".clean.gz", Pipeline(cleaning_stages()))
+    return (lambda: osm_file, run)
+
+
+def bench_convert_osm_2_json(osm_file):
+    ns = load_functions(os.path.join(HERE, "3_json.py"))
+    from cleaning import DtypeConverter
+    dtype = _clean()["DTYPE"]
+
+    def run(f):
+        # convert_osm_2_json writes into ./input/
+        os.chdir(os.path.dirname(os.path.dirname(f)))
+        return ns["convert_osm_2_json"](f, "bench.jsonl", DtypeConverter(dtype))
+    return (lambda: osm_file, run)
+
+
+def bench_process_map(osm_file):
+    sys.path.insert(0, os.path.join(HERE, "lesson6"))
+    import data
+
+    def run(f):
+        return len(data.process_map(f, False))
+    return (lambda: osm_file, run)
+
+
+def bench_process_map_stream(osm_file):
+    sys.path.insert(0, os.path.join(HERE, "lesson6"))
+    import data
+
+    def run(f):
+        return sum(1 for _ in data.process_map(f, False, stream=True))
+    return (lambda: osm_file, run)
+
+
+BENCHMARKS = [("et_parse", bench_et_parse),
+              ("profile_osm", bench_profile_osm),
+              ("build_tag_store", bench_build_tag_store),
+              ("capitalize_words", bench_capitalize_words),
+              ("name_rule_engine", bench_name_rule_engine),
+              ("remove_non_numeric_chars", bench_remove_non_numeric_chars),
+              ("postcode_validator", bench_postcode_validator),
+              ("dtype_converter", bench_dtype_converter),
+              ("cleaning_pipeline", bench_cleaning_pipeline),
+              ("convert_osm_2_json", bench_convert_osm_2_json),
+              ("process_map", bench_process_map),
+              ("process_map_stream", bench_process_map_stream)]
+
+
+def _run_child(bench, osm_file, conn):
+    try:
+        setup, run = bench(osm_file)
+        arg = setup()
+        # Kilobytes on Linux
+        setup_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        elements = run(arg)
+        seconds = time.time() - start
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        conn.send({"seconds": seconds,
+                   "elements": elements,
+                   "elements_per_sec": elements / seconds if seconds > 0 else None,
+                   "setup_rss_kb": setup_rss_kb,
+                   "peak_rss_kb": peak_rss_kb,
+                   "rss_growth_kb": peak_rss_kb - setup_rss_kb})
+    except Exception as e:
+        conn.send({"error": "%s: %s" % (type(e).__name__, e)})
+    finally:
+        conn.close()
+
+
+def run_benchmark(name, bench, osm_file):
+    """
+    Runs a benchmark in a child process so that peak RSS is its own.
+
+    Returns:
+        A dict of name, seconds, elements, elements_per_sec, setup_rss_kb
+        (peak RSS after setup), peak_rss_kb (including setup) and
+        rss_growth_kb (growth of peak RSS during the run), or error.
+    """
+    parent_conn, child_conn = Pipe(False)
+    process = Process(target=_run_child, args=(bench, osm_file, child_conn))
+    process.start()
+    result = parent_conn.recv()
+    process.join()
+    result["name"] = name
+    return result
+
+
+def compare(results, baseline):
+    """
+    Returns a list of (name, seconds, baseline seconds, ratio).
+    """
+    base = dict((r["name"], r) for r in baseline["results"] if "seconds" in r)
+    rows = []
+    for r in results["results"]:
+        if "seconds" in r and r["name"] in base:
+            rows.append((r["name"], r["seconds"], base[r["name"]]["seconds"],
+                         r["seconds"] / base[r["name"]]["seconds"]))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=float, default=0.05,
+                        help="Size relative to the Singapore extract")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", help="Names of benchmarks run")
+    parser.add_argument("--output", default=os.path.join(HERE, "output", "benchmark.json"))
+    parser.add_argument("--compare", help="Results JSON of a previous run")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix="osm-bench-")
+    try:
+        os.mkdir(os.path.join(workdir, "input"))
+        osm_file = os.path.join(workdir, "input", "synthetic.osm")
+        counts = dict((tag, max(1, int(SINGAPORE[tag] * args.scale)))
+                      for tag in ("node", "way", "relation"))
+        generate_osm(osm_file, counts["node"], counts["way"], counts["relation"], args.seed)
+
+        results = {"meta": {"scale": args.scale,
+                            "seed": args.seed,
+                            "counts": counts,
+                            "bytes": os.path.getsize(osm_file),
+                            "python": platform.python_version(),
+                            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
+                   "results": []}
+        for name, bench in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            result = run_benchmark(name, bench, osm_file)
+            results["results"].append(result)
+            if "error" in result:
+                print "%-26s error: %s" % (name, result["error"])
+            else:
+                print "%-26s %8.3f s %12.0f elements/s %8d KB (+%d KB in run)" % (
+                    name, result["seconds"], result["elements_per_sec"] or 0,
+                    result["peak_rss_kb"], result["rss_growth_kb"])
+    finally:
+        shutil.rmtree(workdir)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    if baseline:
+        print ""
+        for name, seconds, base, ratio in compare(results, baseline):
+            print "%-26s %8.3f s (baseline %8.3f s) x%.2f" % (name, seconds, base, ratio)
+    return results
+
+
+if __name__ == "__main__":
+    main()
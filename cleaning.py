@@ -0,0 +1,337 @@
+"""
+Cleaning rules for "v(alue)" of */tag elements.
+"""
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime
+import re
+
+# Characters removed from postal codes
+NON_NUMERIC = re.compile(r"[^0-9]")
+
+# Words kept in lower case by capitalization
+PREPOSITIONS = frozenset(['of', 'at', 'on', 'in', 'by', 'to', 'for', 'and', 'the'])
+
+# Abbreviated words in name: (regular expression, standardized, rule as logged)
+# Lookarounds keep the surrounding spaces out of the match,
+# so that adjacent abbreviations ("opp blk") are all recovered in one pass.
+NAME_ABBREVIATIONS = [(r"^blk(?= )",       "Block",     "'^blk ' -> 'Block '"),
+                      (r"(?<= )blk(?= )",  "Block",     "' blk ' -> ' Block '"),
+                      (r"^opp(?= )",       "Opposite",  "'^opp ' -> 'Opposite '"),
+                      (r"(?<= )opp(?= )",  "Opposite",  "' opp ' -> ' Opposite '"),
+                      (r"^bef(?= )",       "Before",    "'^bef ' -> 'Before '"),
+                      (r"(?<= )bef(?= )",  "Before",    "' bef ' -> ' Before '"),
+                      (r"^aft(?= )",       "After",     "'^aft ' -> 'After '"),
+                      (r"(?<= )aft(?= )",  "After",     "' aft ' -> ' After '")]
+
+# Franchised stores' name: (regular expression, standardized)
+NAME_FRANCHISES = [(r"7.11|7.eleven|seven.11|seven.eleven",                 "7-Eleven"),
+                   (r"starbucks coffee|starbucks",                          "Starbucks"),
+                   (r"mcdonald.s .+|mcdonalds .+|mcdonald.s|mcdonalds",     "McDonald's"),
+                   (r"mos.burger",                                          "MOS Burger"),
+                   (r"pizza.hut .+|pizza.hut",                              "Pizza Hut")]
+
+
+def capitalize_words(value):
+    """
+    Capitalizes head of each word except common prepositions.
+    """
+    words = value.split(' ')
+    for i, word in enumerate(words):
+        if word and word not in PREPOSITIONS:
+            words[i] = word[0].upper() + word[1:]
+    return ' '.join(words)
+
+
+def remove_non_numeric_chars(value):
+    """
+    Removes non-numerical characters in a value.
+    """
+    return NON_NUMERIC.sub("", value)
+
+
+class NameRuleEngine(object):
+    """
+    Applies capitalization and a whole table of standardization rules
+    to a value.
+
+    All rules are compiled into a single case-insensitive alternation,
+    so a value which no rule matches (most of them) is scanned once
+    regardless of the number of rules. Values with a match go through the
+    rules in the order of the table, so that each rule logs its own
+    (before, after) as if it had been applied alone, for every value it
+    matches (even if the value is already standardized).
+
+    Attributes:
+        rules: A list of (regular expression, standardized).
+        labels: A list of rules as logged, e.g. "'^blk ' -> 'Block '".
+                Defaults to "'<regular expression>' -> '<standardized>'".
+        hits: A Counter {rule index: number of values matched by the rule}.
+              Capitalization is counted under "capitalize" (values changed).
+        log: A dict {rule index: list of tuples (before, after)}.
+    """
+    def __init__(self, rules, capitalize=True):
+        self.rules = [(rule[0], rule[1]) for rule in rules]
+        self.labels = [rule[2] if len(rule) > 2 else "'%s' -> '%s'" % (rule[0], rule[1])
+                       for rule in rules]
+        self.capitalize = capitalize
+        self.pattern = re.compile("|".join(["(?:%s)" % exp for exp, _ in self.rules]),
+                                  re.IGNORECASE)
+        self.compiled = [(re.compile(exp, re.IGNORECASE), standardized)
+                         for exp, standardized in self.rules]
+        self.reset()
+
+    def reset(self):
+        """
+        Clears hits and log.
+        """
+        self.hits = Counter()
+        self.log = defaultdict(list)
+
+    def evaluate(self, value):
+        """
+        Returns the value standardized by all rules and a tuple of changes
+        (rule index or "capitalize", before, after), without recording them.
+        The result depends on the value only, so it can be memoized.
+        """
+        changes = []
+        bef = value
+        if self.capitalize:
+            value = capitalize_words(value)
+            if value != bef:
+                changes.append(("capitalize", bef, value))
+        if self.pattern.search(value) is not None:
+            for i, (regex, standardized) in enumerate(self.compiled):
+                if regex.search(value) is not None:
+                    aft = regex.sub(standardized, value)
+                    changes.append((i, value, aft))
+                    value = aft
+        return value, tuple(changes)
+
+    def record(self, changes):
+        """
+        Adds changes returned by evaluate() to hits and log.
+        """
+        for rule, bef, aft in changes:
+            self.hits[rule] += 1
+            self.log[rule].append((bef, aft))
+
+    def apply(self, value):
+        """
+        Returns the value standardized by all rules.
+        Hits and (before, after) of each changed value are recorded.
+        """
+        aft, changes = self.evaluate(value)
+        self.record(changes)
+        return aft
+
+    def clean(self, tag_elements):
+        """
+        Standardizes "v(alue)" of */tag elements.
+
+        Yields:
+            The change is directly reflected in xml elements.
+        Returns:
+            A list of tuples (before, after) of changed values.
+        """
+        modified = []
+        for element in tag_elements:
+            bef = element.get("v")
+            aft = self.apply(bef)
+            if aft != bef:
+                element.set("v", aft)
+                modified.append((bef, aft))
+        return modified
+
+
+class LRUCache(object):
+    """
+    Bounded memo of a function of one value.
+    The least recently used value is evicted when the cache is full.
+
+    Attributes:
+        hits: Number of calls answered from the cache.
+        misses: Number of calls which computed the function.
+    """
+    def __init__(self, func, maxsize=100000):
+        self.func = func
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, value):
+        try:
+            result = self.cache.pop(value)
+            self.hits += 1
+        except KeyError:
+            result = self.func(value)
+            self.misses += 1
+            if len(self.cache) >= self.maxsize:
+                self.cache.popitem(last=False)
+        self.cache[value] = result
+        return result
+
+
+class ValueCleaner(object):
+    """
+    Cleans "v(alue)" of */tag elements once per distinct value.
+    Distinct values go through an LRU cache shared by all calls, and the
+    result is reused for every element which has the value.
+
+    Args:
+        func: A function which returns a cleaned value from a value.
+        maxsize: Maximum number of distinct values cached.
+        record: A function called with the changes of every element, cached
+                or not, e.g. NameRuleEngine.record. func then returns
+                (cleaned value, changes), e.g. NameRuleEngine.evaluate.
+    """
+    def __init__(self, func, maxsize=100000, record=None):
+        self.func = func
+        self.maxsize = maxsize
+        self.record = record
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the cache and the stats.
+        """
+        self.cache = LRUCache(self.func, self.maxsize)
+        self.elements = 0
+
+    def clean_value(self, value):
+        """
+        Returns the cleaned value of an element, computed only if it is not cached.
+        """
+        self.elements += 1
+        result = self.cache(value)
+        if self.record is not None:
+            result, changes = result
+            self.record(changes)
+        return result
+
+    def clean(self, tag_elements):
+        """
+        Cleans "v(alue)" of */tag elements.
+
+        Yields:
+            The change is directly reflected in xml elements.
+        Returns:
+            A list of tuples (before, after) of changed values.
+        """
+        modified = []
+        for element in tag_elements:
+            bef = element.get("v")
+            aft = self.clean_value(bef)
+            if aft != bef:
+                element.set("v", aft)
+                modified.append((bef, aft))
+        return modified
+
+    def stats(self):
+        """
+        Returns a dict of number of elements, values computed
+        and the rate of elements not computed.
+        """
+        computed = self.cache.misses
+        return {"elements": self.elements,
+                "computed": computed,
+                "hit_rate": 1 - float(computed) / self.elements if self.elements else 0.0}
+
+
+def split_timestamp(value):
+    """
+    Splits "YYYY-MM-DDTHH:MM:SSZ" into a tuple (year, month, day, hour,
+    minute, second). Slices the fixed positions instead of datetime.strptime.
+
+    Raises:
+        ValueError: value is not in the format.
+    """
+    if len(value) != 20 or value[4] != '-' or value[7] != '-' or value[10] != 'T' \
+            or value[13] != ':' or value[16] != ':' or value[19] != 'Z':
+        raise ValueError("Invalid timestamp: %r" % value)
+    return (int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13]), int(value[14:16]), int(value[17:19]))
+
+
+def parse_timestamp(value):
+    """
+    Converts "YYYY-MM-DDTHH:MM:SSZ" into datetime.
+
+    Raises:
+        ValueError: value is not in the format.
+    """
+    return datetime(*split_timestamp(value))
+
+# Functions converting a string into each data type of DTYPE
+CONVERTERS = {int: int, float: float, datetime: parse_timestamp}
+
+
+class DtypeConverter(object):
+    """
+    Converts string values of xml attributes into data types of a schema
+    like DTYPE in 2_check_clean.py, one element at a time while streaming.
+    Attributes of str are left as they are.
+
+    Attributes:
+        converters: A dict {path: list of (attr, function, data type name)}.
+        errors: A list of dicts of conversion errors with keys
+                "tag", "attr", "value", "dtype" and "id" (id of the parent).
+    """
+    def __init__(self, dtype):
+        self.converters = {}
+        for path, attrs in dtype.items():
+            self.converters[path] = [(attr, CONVERTERS[t], t.__name__)
+                                     for attr, t in sorted(attrs.items())
+                                     if t in CONVERTERS]
+        self.errors = []
+
+    def convert(self, path, attrib, id_=None):
+        """
+        Returns a copy of attrib with values converted.
+        A value which cannot be converted is kept as it is and recorded in errors.
+
+        Args:
+            path: A tag name like "node" or "node/tag".
+            attrib: A dict of attributes of the element.
+            id_: Id of the parent element recorded in errors.
+        """
+        record = dict(attrib)
+        for attr, func, name in self.converters.get(path, ()):
+            val = record.get(attr)
+            if val is None:
+                continue
+            try:
+                record[attr] = func(val)
+            except ValueError:
+                self.errors.append({"tag": path, "attr": attr, "value": val,
+                                    "dtype": name, "id": id_})
+        return record
+
+
+class PostcodeValidator(object):
+    """
+    Validates postal codes by length and a set of valid prefixes.
+    Only decides which postcodes to keep; removal and its log are left to
+    the caller, e.g. pipeline.FilterStage with is_valid as keep.
+
+    Args:
+        length: Number of digits of a valid postal code.
+        prefixes: Valid first digits (e.g. districts).
+    """
+    def __init__(self, length, prefixes):
+        self.length = length
+        self.prefixes = frozenset(prefixes)
+        self.prefix_length = len(next(iter(self.prefixes)))
+
+    def is_valid(self, postcode):
+        return len(postcode) == self.length and \
+               postcode[:self.prefix_length] in self.prefixes
+
+
+# Postal codes of Singapore: six digits, first two digits are a district
+# between 01 and 82 except 74.
+# [Reference] https://en.wikipedia.org/wiki/Postal_codes_in_Singapore
+SINGAPORE_POSTCODE = (6, ["%02d" % i for i in xrange(1, 83) if i != 74])
+
+# Rule tables (length, prefixes) per country code for PostcodeValidator
+POSTCODE_RULES = {"SG": SINGAPORE_POSTCODE}
@@ -0,0 +1,35 @@
+"""
+Column arrays filled while parsing and handed over to NumPy.
+
+A column is a tuple (name, array typecode while parsing, NumPy dtype).
+Values are appended to an array.array of the typecode, which grows cheaply
+and holds them unboxed, and the filled buffer is viewed as a NumPy array
+without a copy.
+"""
+from array import array
+
+import numpy as np
+
+
+def new_buffers(columns):
+    """
+    Returns a dict {name: empty array.array of the typecode} of columns.
+    """
+    return dict((name, array(typecode)) for name, typecode, _ in columns)
+
+
+def to_numpy(buf, dtype):
+    """
+    Returns a NumPy array viewing an array.array buffer,
+    or an empty array if the buffer is empty (np.frombuffer rejects it).
+    """
+    if buf:
+        return np.frombuffer(buf, dtype=dtype)
+    return np.empty(0, dtype=dtype)
+
+
+def columns_to_numpy(buffers, columns):
+    """
+    Returns a dict {name: NumPy array} of buffers returned by new_buffers.
+    """
+    return dict((name, to_numpy(buffers[name], dtype)) for name, _, dtype in columns)
@@ -0,0 +1,149 @@
+"""
+Uniform grid index over node coordinates.
+
+Nodes are bucketed into cells of a fixed size in degrees within bounds.
+Node positions are sorted by cell with offsets per cell (like a CSR matrix),
+so a bbox or radius query only looks at nodes in overlapping cells, and
+the node count per cell is kept for density maps.
+"""
+import os
+
+import numpy as np
+
+from node_store import coordinate_extent
+
+# Mean radius of the earth in meters
+EARTH_RADIUS = 6371000.0
+
+
+def grid_shape(bounds, cell_size):
+    """
+    Returns (number of rows (lat), number of columns (lon)) of a grid.
+    """
+    return (max(int(np.ceil((bounds["maxlat"] - bounds["minlat"]) / cell_size)), 1),
+            max(int(np.ceil((bounds["maxlon"] - bounds["minlon"]) / cell_size)), 1))
+
+
+def _rows_cols(bounds, cell_size, shape, lat, lon):
+    rows = np.clip(((np.asarray(lat) - bounds["minlat"]) // cell_size).astype(np.int64),
+                   0, shape[0] - 1)
+    cols = np.clip(((np.asarray(lon) - bounds["minlon"]) // cell_size).astype(np.int64),
+                   0, shape[1] - 1)
+    return rows, cols
+
+
+class GridIndex(object):
+    """
+    Attributes:
+        lat, lon: Coordinate arrays of nodes the index was built from.
+        bounds: A dict of "minlat", "minlon", "maxlat" and "maxlon".
+        cell_size: Size of a cell in degrees.
+        shape: (number of rows (lat), number of columns (lon)).
+        order: Positions of nodes (in lat/lon) sorted by cell.
+        offsets: Nodes of cell c are order[offsets[c]:offsets[c + 1]].
+        counts: A 2D array of node count per cell (rows from minlat).
+    """
+    def __init__(self, lat, lon, bounds, cell_size, order, offsets):
+        self.lat = lat
+        self.lon = lon
+        self.bounds = bounds
+        self.cell_size = cell_size
+        self.shape = grid_shape(bounds, cell_size)
+        self.order = order
+        self.offsets = offsets
+        self.counts = np.diff(offsets).reshape(self.shape)
+
+    @classmethod
+    def build(cls, lat, lon, bounds=None, cell_size=0.005):
+        """
+        Builds a grid index from coordinate arrays, e.g. of a NodeStore.
+        Nodes out of bounds or without valid coordinates are not indexed.
+        Without bounds (no <bounds> in the file), the grid covers the
+        extent of the coordinates.
+        """
+        lat = np.asarray(lat)
+        lon = np.asarray(lon)
+        if bounds is None:
+            bounds = coordinate_extent(lat, lon)
+        shape = grid_shape(bounds, cell_size)
+        with np.errstate(invalid='ignore'):
+            valid = ((lat >= bounds["minlat"]) & (lat <= bounds["maxlat"]) &
+                     (lon >= bounds["minlon"]) & (lon <= bounds["maxlon"]))
+        positions = np.flatnonzero(valid)
+        rows, cols = _rows_cols(bounds, cell_size, shape, lat[positions], lon[positions])
+        cells = rows * shape[1] + cols
+        sort = np.argsort(cells, kind='mergesort')
+        offsets = np.searchsorted(cells[sort], np.arange(shape[0] * shape[1] + 1))
+        return cls(lat, lon, bounds, cell_size, positions[sort], offsets)
+
+    def candidates(self, minlat, minlon, maxlat, maxlon):
+        """
+        Returns positions of nodes in cells overlapping a bounding box.
+        """
+        (r0, r1), (c0, c1) = _rows_cols(self.bounds, self.cell_size, self.shape,
+                                        [minlat, maxlat], [minlon, maxlon])
+        ncols = self.shape[1]
+        parts = [self.order[self.offsets[row * ncols + c0]:self.offsets[row * ncols + c1 + 1]]
+                 for row in xrange(r0, r1 + 1)]
+        return np.concatenate(parts)
+
+    def bbox(self, minlat, minlon, maxlat, maxlon):
+        """
+        Returns positions of nodes within a bounding box.
+        """
+        pos = self.candidates(minlat, minlon, maxlat, maxlon)
+        la = self.lat[pos]
+        lo = self.lon[pos]
+        return pos[(la >= minlat) & (la <= maxlat) & (lo >= minlon) & (lo <= maxlon)]
+
+    def radius(self, center_lat, center_lon, meters):
+        """
+        Returns positions of nodes within a distance (haversine) of a point.
+        """
+        dlat = np.degrees(meters / EARTH_RADIUS)
+        dlon = dlat / max(np.cos(np.radians(center_lat)), 1e-12)
+        pos = self.candidates(center_lat - dlat, center_lon - dlon,
+                              center_lat + dlat, center_lon + dlon)
+        la = np.radians(self.lat[pos])
+        lo = np.radians(self.lon[pos])
+        clat = np.radians(center_lat)
+        clon = np.radians(center_lon)
+        a = np.sin((la - clat) / 2) ** 2 + \
+            np.cos(clat) * np.cos(la) * np.sin((lo - clon) / 2) ** 2
+        distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+        return pos[distance <= meters]
+
+    def density(self):
+        """
+        Returns (counts, lat edges, lon edges) for a density map,
+        e.g. plt.pcolormesh(lon_edges, lat_edges, counts).
+        """
+        lat_edges = self.bounds["minlat"] + self.cell_size * np.arange(self.shape[0] + 1)
+        lon_edges = self.bounds["minlon"] + self.cell_size * np.arange(self.shape[1] + 1)
+        return self.counts, lat_edges, lon_edges
+
+    def save(self, directory):
+        """
+        Saves the index as .npy files.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        np.save(os.path.join(directory, "order.npy"), self.order)
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, "grid.npy"),
+                np.array([self.bounds["minlat"], self.bounds["minlon"],
+                          self.bounds["maxlat"], self.bounds["maxlon"], self.cell_size]))
+
+    @classmethod
+    def load(cls, directory, lat, lon, mmap_mode='r'):
+        """
+        Loads an index saved by save(), memory-mapped by default.
+
+        Args:
+            lat, lon: Coordinate arrays the index was built from.
+        """
+        g = np.load(os.path.join(directory, "grid.npy"))
+        bounds = {"minlat": g[0], "minlon": g[1], "maxlat": g[2], "maxlon": g[3]}
+        return cls(lat, lon, bounds, g[4],
+                   np.load(os.path.join(directory, "order.npy"), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, "offsets.npy"), mmap_mode=mmap_mode))
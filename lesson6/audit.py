@@ -54,12 +54,72 @@ def audit(osmfile):
 
 
 def update_name(name, mapping):
-    for k in mapping.keys():
-        if re.search(k, name) is not None:
-            return name.replace(k, mapping[k])
+    # Only the trailing street type is looked up and replaced,
+    # so the cost does not depend on the size of mapping.
+    m = street_type_re.search(name)
+    if m:
+        street_type = m.group()
+        if street_type in mapping:
+            return name[:m.start()] + mapping[street_type]
     return name
 
 
+class StreetNameMapper(object):
+    """
+    update_name with memo of names already seen.
+    """
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.cache = {}
+
+    def update(self, name):
+        try:
+            return self.cache[name]
+        except KeyError:
+            better_name = self.cache[name] = update_name(name, self.mapping)
+            return better_name
+
+    def update_all(self, names):
+        """
+        Returns a dict {name: better name} of names changed.
+        """
+        updated = {}
+        for name in names:
+            better_name = self.update(name)
+            if better_name != name:
+                updated[name] = better_name
+        return updated
+
+
+def iter_street_names(osmfile):
+    """
+    Yields addr:street values of nodes and ways streaming over the file.
+    Each top level element is cleared from the root once it has been read.
+    """
+    context = ET.iterparse(osmfile, events=("start", "end"))
+    _, root = next(context)
+    depth = 0
+    parent = None
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                parent = elem.tag
+            continue
+        depth -= 1
+        if parent in ("node", "way") and elem.tag == "tag" and is_street_name(elem):
+            yield elem.attrib['v']
+        if depth == 0:
+            root.clear()
+
+
+def update_street_names(osmfile, mapping):
+    """
+    Returns a dict {name: better name} of all addr:street values changed by mapping.
+    """
+    return StreetNameMapper(mapping).update_all(iter_street_names(osmfile))
+
+
 def test():
     st_types = audit(OSMFILE)
     assert len(st_types) == 3
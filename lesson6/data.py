@@ -5,6 +5,7 @@ import pprint
 import re
 import codecs
 import json
+from tags import classify_key
 """
 Your task is to wrangle the data and transform the shape of the data
 into the model we mentioned earlier. The output should be a list of dictionaries
@@ -93,57 +94,98 @@ problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 CREATED = [ "version", "changeset", "timestamp", "user", "uid"]
 
 
+# Attributes not copied as they are
+SPECIAL_ATTRIBUTES = frozenset(CREATED + ["lat", "lon"])
+
+
 def shape_element(element):
-    node = {}
-    if element.tag == "node" or element.tag == "way" :
-        node['type'] = element.tag
-        pos = []
-        for k in element.keys():
-            if k in CREATED:
-                if "created" in node:
-                    node["created"][k] = element.get(k)
-                else:
-                    node["created"] = {}
-                    node["created"][k] = element.get(k)
-            elif k == "lat":
-                pos.insert(0, float(element.get(k)))
-                if len(pos) == 2:
-                    node["pos"] = pos
+    tag = element.tag
+    if tag != "node" and tag != "way":
+        return None
+    node = {'type': tag}
+    created = {}
+    lat = lon = None
+    for k, v in element.attrib.iteritems():
+        if k in SPECIAL_ATTRIBUTES:
+            if k == "lat":
+                lat = v
             elif k == "lon":
-                pos.append(float(element.get(k)))
-                if len(pos) == 2:
-                    node["pos"] = pos
+                lon = v
             else:
-                node[k] = element.get(k)
-                
-        for t in element.iter("tag"):
-            key = t.get("k")
-            val = t.get("v")
-            if problemchars.search(key) is not None:
+                created[k] = v
+        else:
+            node[k] = v
+    if created:
+        node["created"] = created
+    if lat is not None and lon is not None:
+        node["pos"] = [float(lat), float(lon)]
+
+    address = {}
+    refs = [] if tag == "way" else None
+    for child in element:
+        child_tag = child.tag
+        if child_tag == "tag":
+            key = child.get("k")
+            category, (prefix, name) = classify_key(key)
+            if category == "problemchars":
                 continue
-            elif key.startswith("addr:"):
-                key = key.replace("addr:", "")
-                if re.search(":", key) is not None:
-                    continue
-                if "address" in node:
-                    node["address"][key] = val
-                else:
-                    node["address"] = {}
-                    node["address"][key] = val
+            elif prefix == "addr":
+                # A second ":" separates the type/direction of a street
+                if ":" not in name:
+                    address[name] = child.get("v")
             else:
-                node[key] = val
-        
-        if element.tag == "way":
-            node["node_refs"] = []
-        for t in element.iter("nd"):
-            node["node_refs"].append(t.get("ref"))
-        return node
-    else:
-        return None
+                node[key] = child.get("v")
+        elif child_tag == "nd" and refs is not None:
+            refs.append(child.get("ref"))
+    if address:
+        node["address"] = address
+    if refs is not None:
+        node["node_refs"] = refs
+    return node
+
+
+def iter_shaped(file_in):
+    """
+    Yields shaped top level elements in constant memory.
+    Each top level element is cleared from the root (with its predecessors)
+    once it has been shaped, so the parsed tree never grows.
+    """
+    context = ET.iterparse(file_in, events=('start', 'end'))
+    _, root = next(context)
+    depth = 0
+    for event, element in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            el = shape_element(element)
+            root.clear()
+            if el:
+                yield el
+
+
+def _stream_map(file_in, pretty, batch_size):
+    file_out = "{0}.json".format(file_in)
+    indent = 2 if pretty else None
+    with codecs.open(file_out, "w") as fo:
+        batch = []
+        for el in iter_shaped(file_in):
+            batch.append(json.dumps(el, indent=indent) + "\n")
+            if len(batch) >= batch_size:
+                fo.write("".join(batch))
+                batch = []
+            yield el
+        fo.write("".join(batch))
 
 
-def process_map(file_in, pretty = False):
+def process_map(file_in, pretty = False, stream = False, batch_size = 1000):
     # You do not need to change this file
+    # stream=True returns a generator of shaped elements instead of a list.
+    # Elements are cleared after shaping and written in batches of batch_size,
+    # so memory does not grow with the file. Consume it to write the file.
+    if stream:
+        return _stream_map(file_in, pretty, batch_size)
     file_out = "{0}.json".format(file_in)
     data = []
     with codecs.open(file_out, "w") as fo:
@@ -14,13 +14,24 @@ import xml.etree.cElementTree as ET
 import pprint
 
 def count_tags(filename):
-    tree = ET.parse(filename)
-    tags = {}
-    for e in tree.iter():
-        if e.tag not in tags:
-            tags[e.tag] = 1
+    # Counts at the start of each element and clears top level elements
+    # once they end, so the whole tree is never held in memory.
+    # (See runner.py to count tags together with the other audits.)
+    context = ET.iterparse(filename, events=('start', 'end'))
+    _, root = next(context)
+    tags = {root.tag: 1}
+    depth = 0
+    for event, e in context:
+        if event == 'start':
+            depth += 1
+            if e.tag not in tags:
+                tags[e.tag] = 1
+            else:
+                tags[e.tag] += 1
         else:
-            tags[e.tag] += 1
+            depth -= 1
+            if depth == 0:
+                root.clear()
     return tags
 
 def test():
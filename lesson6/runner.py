@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs several audits of the map file in a single iterparse pass.
+
+Each audit is an Auditor plug-in with on_element (called for every element),
+on_tag (called for every tag with its parent) and result. The standard
+audits are the ones of mapparser.py, tags.py, users.py and audit.py.
+With workers, parsed elements are sent in batches to a process pool where
+copies of the auditors visit them, and the copies are merged afterwards.
+Parsing stays in this process and every element is packed and pickled,
+so workers are about 2x slower with the standard audits; they only pay
+off for large files with expensive auditors on several CPUs.
+"""
+import xml.etree.cElementTree as ET
+from collections import defaultdict
+import cPickle as pickle
+from multiprocessing import Pool
+import pprint
+
+from tags import classify_key
+from users import get_user
+from audit import audit_street_type, is_street_name
+
+
+class Auditor(object):
+    def on_element(self, element):
+        pass
+
+    def on_tag(self, parent, tag):
+        pass
+
+    def merge(self, other):
+        """
+        Adds the state of another auditor of the same type (from a worker).
+        """
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class TagCountAuditor(Auditor):
+    """
+    Number of elements per tag name, like mapparser.count_tags.
+    """
+    def __init__(self):
+        self.tags = defaultdict(int)
+
+    def on_element(self, element):
+        self.tags[element.tag] += 1
+
+    def merge(self, other):
+        for tag, count in other.tags.iteritems():
+            self.tags[tag] += count
+
+    def result(self):
+        return dict(self.tags)
+
+
+class KeyTypeAuditor(Auditor):
+    """
+    Number of tags per key category, like tags.process_map.
+    """
+    def __init__(self):
+        self.keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
+
+    def on_tag(self, parent, tag):
+        self.keys[classify_key(tag.get('k'))[0]] += 1
+
+    def merge(self, other):
+        for category, count in other.keys.iteritems():
+            self.keys[category] += count
+
+    def result(self):
+        return self.keys
+
+
+class UserAuditor(Auditor):
+    """
+    Set of unique user ids, like users.process_map.
+    """
+    def __init__(self):
+        self.users = set()
+
+    def on_element(self, element):
+        uid = get_user(element)
+        if uid is not None:
+            self.users.add(uid)
+
+    def merge(self, other):
+        self.users |= other.users
+
+    def result(self):
+        return self.users
+
+
+class StreetTypeAuditor(Auditor):
+    """
+    Street names per unexpected street type, like audit.audit.
+    """
+    def __init__(self):
+        self.street_types = defaultdict(set)
+
+    def on_tag(self, parent, tag):
+        if (parent.tag == "node" or parent.tag == "way") and is_street_name(tag):
+            audit_street_type(self.street_types, tag.attrib['v'])
+
+    def merge(self, other):
+        for street_type, names in other.street_types.iteritems():
+            self.street_types[street_type] |= names
+
+    def result(self):
+        return self.street_types
+
+
+def standard_auditors():
+    return [TagCountAuditor(), KeyTypeAuditor(), UserAuditor(), StreetTypeAuditor()]
+
+
+def visit(auditors, element):
+    """
+    Visits a top level element and all elements under it.
+    """
+    for e in element.iter():
+        for auditor in auditors:
+            auditor.on_element(e)
+    for tag in element.iter("tag"):
+        for auditor in auditors:
+            auditor.on_tag(element, tag)
+
+
+def _pack(element):
+    # Elements cannot be pickled, so the whole subtree is sent as tuples
+    return (element.tag, dict(element.attrib), [_pack(child) for child in element])
+
+
+def _unpack(packed, parent=None):
+    tag, attrib, children = packed
+    if parent is None:
+        element = ET.Element(tag, attrib)
+    else:
+        element = ET.SubElement(parent, tag, attrib)
+    for child in children:
+        _unpack(child, element)
+    return element
+
+
+def _audit_batch(args):
+    template, batch = args
+    auditors = pickle.loads(template)
+    for packed in batch:
+        visit(auditors, _unpack(packed))
+    return auditors
+
+
+def _batches(context, root, size):
+    batch = []
+    depth = 0
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            batch.append(_pack(elem))
+            root.clear()
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def run_audits(filename, auditors=None, workers=None, batch_size=1000):
+    """
+    Runs auditors over a map file in a single iterparse pass.
+
+    Args:
+        filename: A map file name.
+        auditors: A list of Auditor objects. Defaults to standard_auditors().
+        workers: Number of worker processes. None visits elements in this process,
+                 which is faster unless the auditors are expensive (see above).
+        batch_size: Number of top level elements sent to a worker at once.
+    Returns:
+        A list of results of the auditors.
+    """
+    if auditors is None:
+        auditors = standard_auditors()
+    context = ET.iterparse(filename, events=('start', 'end'))
+    _, root = next(context)
+    if workers:
+        template = pickle.dumps(auditors, pickle.HIGHEST_PROTOCOL)
+        pool = Pool(workers)
+        try:
+            tasks = ((template, batch) for batch in _batches(context, root, batch_size))
+            for partial in pool.imap_unordered(_audit_batch, tasks):
+                for auditor, other in zip(auditors, partial):
+                    auditor.merge(other)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        depth = 0
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 0:
+                visit(auditors, elem)
+                root.clear()
+    # The root itself, after its children have been cleared
+    for auditor in auditors:
+        auditor.on_element(root)
+    return [auditor.result() for auditor in auditors]
+
+
+def test():
+    import audit
+    import mapparser
+    import tags
+    import users
+    expected = [mapparser.count_tags('example.osm'),
+                tags.process_map('example.osm'),
+                users.process_map('example.osm'),
+                audit.audit('example.osm')]
+    for workers in (None, 2):
+        results = run_audits('example.osm', workers=workers)
+        pprint.pprint(results)
+        assert results == expected
+
+
+if __name__ == "__main__":
+    test()
@@ -31,16 +31,39 @@ lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
 problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
 
+# {k: (category, normalized key)}, shared by key_type, data.shape_element
+# and the audits. Distinct keys number only in the hundreds, so the regexes
+# run once per key and every other tag is a dictionary lookup.
+_key_types = {}
+
+
+def classify_key(k):
+    """
+    Returns (category, normalized key) of "k(ey)" of a tag element.
+    category is "lower", "lower_colon", "problemchars" or "other".
+    normalized key is a tuple (prefix, name) split at the first ":",
+    e.g. ("addr", "street") for "addr:street", or (None, k) without ":".
+    """
+    try:
+        return _key_types[k]
+    except KeyError:
+        pass
+    if lower.search(k) is not None:
+        category = "lower"
+    elif lower_colon.search(k) is not None:
+        category = "lower_colon"
+    elif problemchars.search(k) is not None:
+        category = "problemchars"
+    else:
+        category = "other"
+    prefix, colon, name = k.partition(":")
+    result = _key_types[k] = (category, (prefix, name) if colon else (None, k))
+    return result
+
+
 def key_type(element, keys):
     if element.tag == "tag":
-        if lower.search(element.get('k')) is not None:
-            keys["lower"] += 1
-        elif lower_colon.search(element.get('k')) is not None:
-            keys["lower_colon"] += 1
-        elif problemchars.search(element.get('k')) is not None:
-            keys["problemchars"] += 1
-        else:
-            keys["other"] += 1
+        keys[classify_key(element.get('k'))[0]] += 1
     return keys
 
 
@@ -0,0 +1,96 @@
+"""
+Batched, parallel loading of records into a MongoDB collection.
+
+Works with any object that has the pymongo Collection API
+(insert_many, create_index), e.g. a mongomock collection for offline runs.
+"""
+from itertools import islice
+from Queue import Queue
+import threading
+import time
+
+from pymongo import ASCENDING, GEOSPHERE
+
+# Indexes built after loading: (name, keys)
+INDEXES = [("xml",       [("xml", ASCENDING)]),
+           ("tag_k",     [("tag.k", ASCENDING)]),
+           ("user",      [("user", ASCENDING)]),
+           ("timestamp", [("timestamp", ASCENDING)]),
+           ("pos",       [("pos", GEOSPHERE)])]
+
+
+def iter_batches(records, batch_size):
+    """
+    Yields lists of at most batch_size records.
+    """
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_records(collection, records, batch_size=1000, workers=4):
+    """
+    Inserts records into a collection in batches with a pool of threads.
+    Batches are inserted with ordered=False and at most 2 * workers batches
+    are waiting at any time, so records can be a generator over a large file.
+
+    Args:
+        collection: A collection object.
+        records: An iterable of record dicts.
+        batch_size: Number of records per insert_many.
+        workers: Number of threads inserting batches.
+    Returns:
+        A dict of number of docs, batches, seconds and docs/sec.
+    """
+    queue = Queue(maxsize=2 * workers)
+    counts = []
+    errors = []
+
+    def insert():
+        count = 0
+        while True:
+            batch = queue.get()
+            if batch is None:
+                break
+            try:
+                collection.insert_many(batch, ordered=False)
+                count += len(batch)
+            except Exception as e:
+                errors.append(e)
+        counts.append(count)
+
+    start = time.time()
+    threads = [threading.Thread(target=insert) for _ in xrange(workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    batches = 0
+    for batch in iter_batches(records, batch_size):
+        queue.put(batch)
+        batches += 1
+    for _ in threads:
+        queue.put(None)
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+    seconds = time.time() - start
+    docs = sum(counts)
+    return {"docs": docs,
+            "batches": batches,
+            "seconds": seconds,
+            "docs_per_sec": docs / seconds if seconds > 0 else float(docs)}
+
+
+def build_indexes(collection, indexes=INDEXES):
+    """
+    Builds indexes on a collection. Call after loading for a faster load.
+
+    Returns:
+        A list of index names created.
+    """
+    return [collection.create_index(keys, name=name) for (name, keys) in indexes]
@@ -0,0 +1,168 @@
+"""
+Columnar store of nodes in NumPy arrays.
+
+Each attribute of node is held in its own array instead of an Element
+with a dict of strings, which takes tens of bytes per node instead of
+hundreds. Arrays are saved as .npy files and can be loaded memory-mapped.
+"""
+import calendar
+import os
+
+import numpy as np
+
+from cleaning import split_timestamp
+from columns import columns_to_numpy, new_buffers
+from osm_stream import iter_elements
+
+# Columns of nodes (see columns.py)
+COLUMNS = [("id",        'l', np.int64),
+           ("lat",       'd', np.float64),
+           ("lon",       'd', np.float64),
+           ("uid",       'i', np.int32),
+           ("timestamp", 'l', np.int64)]
+
+# Value stored for a timestamp which cannot be parsed
+INVALID_TIMESTAMP = -1
+
+# Range of valid coordinates, checked when the file has no <bounds>
+WORLD_BOUNDS = {"minlat": -90.0, "minlon": -180.0, "maxlat": 90.0, "maxlon": 180.0}
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+class NodeStore(object):
+    """
+    Nodes as columns of NumPy arrays in the order of the file.
+
+    Attributes:
+        id, lat, lon, uid, timestamp: Arrays of the same length.
+        bounds: A dict of "minlat", "minlon", "maxlat" and "maxlon".
+    """
+    def __init__(self, columns, bounds=None):
+        for name, _, _ in COLUMNS:
+            setattr(self, name, columns[name])
+        self.bounds = bounds
+
+    def __len__(self):
+        return len(self.id)
+
+    def extent(self):
+        """
+        Returns the bounding box of valid coordinates as a dict of
+        "minlat", "minlon", "maxlat" and "maxlon".
+
+        Raises:
+            ValueError: There is no node with valid coordinates.
+        """
+        return coordinate_extent(self.lat, self.lon)
+
+    def save(self, directory):
+        """
+        Saves each column as "<directory>/<column>.npy".
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name, _, _ in COLUMNS:
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+        if self.bounds is not None:
+            np.save(os.path.join(directory, "bounds.npy"),
+                    np.array([self.bounds["minlat"], self.bounds["minlon"],
+                              self.bounds["maxlat"], self.bounds["maxlon"]]))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Loads columns saved by save(), memory-mapped by default.
+        """
+        columns = dict((name, np.load(os.path.join(directory, name + ".npy"),
+                                      mmap_mode=mmap_mode))
+                       for name, _, _ in COLUMNS)
+        bounds = None
+        path = os.path.join(directory, "bounds.npy")
+        if os.path.exists(path):
+            b = np.load(path)
+            bounds = {"minlat": b[0], "minlon": b[1], "maxlat": b[2], "maxlon": b[3]}
+        return cls(columns, bounds)
+
+
+def build_node_store(osm_file):
+    """
+    Builds a NodeStore streaming over an OSM XML file.
+    Coordinates which cannot be parsed are stored as NaN and timestamps
+    as INVALID_TIMESTAMP.
+    """
+    buffers = new_buffers(COLUMNS)
+    ids = buffers["id"]
+    lats = buffers["lat"]
+    lons = buffers["lon"]
+    uids = buffers["uid"]
+    timestamps = buffers["timestamp"]
+    bounds = None
+    for element in iter_elements(osm_file, ('bounds', 'node')):
+        get = element.get
+        if element.tag == 'bounds':
+            bounds = dict((k, float(get(k))) for k in ("minlat", "minlon", "maxlat", "maxlon"))
+            continue
+        ids.append(int(get("id")))
+        lats.append(_to_float(get("lat")))
+        lons.append(_to_float(get("lon")))
+        uids.append(int(get("uid", -1)))
+        try:
+            timestamps.append(calendar.timegm(split_timestamp(get("timestamp", ""))))
+        except ValueError:
+            timestamps.append(INVALID_TIMESTAMP)
+    return NodeStore(columns_to_numpy(buffers, COLUMNS), bounds)
+
+
+def coordinate_extent(lat, lon):
+    """
+    Returns the bounding box of coordinate arrays ignoring NaN.
+
+    Raises:
+        ValueError: There are no valid coordinates.
+    """
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    if not valid.any():
+        raise ValueError("No node with valid coordinates.")
+    return {"minlat": float(lat[valid].min()), "minlon": float(lon[valid].min()),
+            "maxlat": float(lat[valid].max()), "maxlon": float(lon[valid].max())}
+
+
+def check_bounds(store, bounds=None, n_samples=10):
+    """
+    Checks if latitude and longitude of nodes are within bounds
+    with vectorized comparisons of the coordinate arrays.
+
+    Args:
+        store: A NodeStore object.
+        bounds: A dict of "minlat", "minlon", "maxlat" and "maxlon".
+                Defaults to the bounds of the store, or WORLD_BOUNDS
+                if the file has no <bounds>.
+        n_samples: Number of offending node ids kept per check.
+    Returns:
+        A dict {check: {"count": int, "ids": list of sample node ids}}
+        for checks "lat" and "lon" (out of range) and "nan" (not a number).
+    """
+    if bounds is None:
+        bounds = store.bounds if store.bounds is not None else WORLD_BOUNDS
+    lat = np.asarray(store.lat)
+    lon = np.asarray(store.lon)
+    nan = np.isnan(lat) | np.isnan(lon)
+    # Comparisons with NaN are False, so NaN is only reported under "nan"
+    with np.errstate(invalid='ignore'):
+        masks = {"lat": (lat < bounds["minlat"]) | (lat > bounds["maxlat"]),
+                 "lon": (lon < bounds["minlon"]) | (lon > bounds["maxlon"]),
+                 "nan": nan}
+    report = {}
+    for check, mask in masks.items():
+        offending = np.flatnonzero(mask)
+        report[check] = {"count": int(offending.size),
+                         "ids": [int(i) for i in store.id[offending[:n_samples]]]}
+    return report
@@ -0,0 +1,183 @@
+"""
+Indexes built from OSM XML files in a streaming pass.
+"""
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+
+from columns import to_numpy
+from osm_stream import Reducer, iter_elements, map_shards
+
+
+class IdIndex(object):
+    """
+    Compact index of element ids held in a sorted array of 64 bit integers.
+    Ids in OSM files are normally written in ascending order, so appending
+    keeps the array sorted and freeze() does not need to sort again.
+    """
+    def __init__(self):
+        self.ids = array('l')
+        self._sorted = True
+
+    def add(self, id_):
+        if self._sorted and self.ids and id_ < self.ids[-1]:
+            self._sorted = False
+        self.ids.append(id_)
+
+    def extend(self, other):
+        """
+        Appends ids of another IdIndex (e.g. of the next shard).
+        """
+        if other.ids:
+            self._sorted = (self._sorted and other._sorted and
+                            (not self.ids or self.ids[-1] <= other.ids[0]))
+            self.ids.extend(other.ids)
+
+    def freeze(self):
+        """
+        Sorts ids if they were not added in ascending order.
+        Must be called after the last add() and before lookups.
+        """
+        if not self._sorted:
+            self.ids = array('l', sorted(self.ids))
+            self._sorted = True
+        return self
+
+    def position(self, id_):
+        """
+        Returns position of the id in the index, or -1 if it does not exist.
+        """
+        i = bisect_left(self.ids, id_)
+        if i < len(self.ids) and self.ids[i] == id_:
+            return i
+        return -1
+
+    def __contains__(self, id_):
+        return self.position(id_) >= 0
+
+    def contains(self, refs):
+        """
+        Returns a boolean array which is True where ids in refs exist,
+        looked up with a single np.searchsorted.
+
+        Args:
+            refs: An array of 64 bit integer ids.
+        """
+        ids = to_numpy(self.ids, np.int64)
+        i = np.searchsorted(ids, refs)
+        found = np.zeros(len(refs), dtype=bool)
+        inside = i < len(ids)
+        found[inside] = ids[i[inside]] == refs[inside]
+        return found
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class IdIndexReducer(Reducer):
+    """
+    Collects ids of node, way and relation into IdIndex per tag.
+    """
+    def __init__(self):
+        self.index = dict((tag, IdIndex()) for tag in ('node', 'way', 'relation'))
+
+    def visit(self, element):
+        self.index[element.tag].add(int(element.get("id")))
+
+    def merge(self, other):
+        for tag, idx in other.index.items():
+            self.index[tag].extend(idx)
+        return self
+
+    def result(self):
+        for idx in self.index.values():
+            idx.freeze()
+        return self.index
+
+
+def build_id_index(osm_file, workers=1):
+    """
+    Builds id indexes of node, way and relation.
+
+    Args:
+        osm_file: A file name of OSM XML.
+        workers: Number of processes parsing shards of the file.
+                 None uses all CPUs.
+    Returns:
+        A dict {tag: IdIndex}.
+    """
+    if workers == 1:
+        reducer = IdIndexReducer()
+        for element in iter_elements(osm_file):
+            reducer.visit(element)
+    else:
+        reducer = map_shards(osm_file, IdIndexReducer, workers=workers)
+    return reducer.result()
+
+
+# Number of refs collected before they are looked up in the id indexes
+REF_BATCH = 1 << 20
+
+
+def _check_refs(index, owners, pending, dangling):
+    """
+    Looks up refs collected in pending {type: (positions, refs)} with one
+    np.searchsorted per member type, and appends those not existing to
+    dangling in the order of positions, i.e. in file order.
+    """
+    missing = []
+    for type_, (positions, refs) in pending.items():
+        refs = to_numpy(refs, np.int64)
+        if type_ in index:
+            lost = np.flatnonzero(~index[type_].contains(refs))
+        else:
+            lost = np.arange(len(refs))
+        positions = to_numpy(positions, np.int64)
+        missing.extend((int(positions[i]), type_, int(refs[i])) for i in lost)
+    for position, type_, ref in sorted(missing):
+        dangling[owners[position]].append((type_, ref))
+
+
+def find_dangling_refs(osm_file, index=None, workers=1):
+    """
+    Checks if references pointing to elements exist.
+        [Pointer]
+            "way/nd@ref"            -> node
+            "relation/member@ref"   -> node, way or relation by "type"
+        [Origin]
+            "node@id", "way@id", "relation@id"
+    Refs are collected per member type in batches of REF_BATCH and looked
+    up in the sorted ids at once instead of one bisect per ref.
+
+    Args:
+        osm_file: A file name of OSM XML. It is read twice when index is None.
+        index: A dict {tag: IdIndex} returned by build_id_index.
+        workers: Number of processes building the index when index is None.
+    Returns:
+        A dict {(parent tag, parent id): list of (type, ref) not existing}.
+    """
+    if index is None:
+        index = build_id_index(osm_file, workers)
+    dangling = defaultdict(list)
+    owners = []
+    pending = defaultdict(lambda: (array('l'), array('l')))
+    for element in iter_elements(osm_file, ('way', 'relation')):
+        owner = (element.tag, int(element.get("id")))
+        if element.tag == "way":
+            members = [("node", nd.get("ref")) for nd in element.iter("nd")]
+        else:
+            members = [(member.get("type"), member.get("ref"))
+                       for member in element.iter("member")]
+        for type_, ref in members:
+            positions, refs = pending[type_]
+            positions.append(len(owners))
+            refs.append(int(ref))
+            owners.append(owner)
+        if len(owners) >= REF_BATCH:
+            _check_refs(index, owners, pending, dangling)
+            owners = []
+            pending.clear()
+    _check_refs(index, owners, pending, dangling)
+    return dict(dangling)
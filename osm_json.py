@@ -0,0 +1,123 @@
+"""
+Conversion of OSM XML elements into JSON Lines records.
+
+A record is a dict of the attributes of a top level element with
+a field "xml" for the tag name, "pos" of nodes as [lon, lat] and
+"tag", "member" and "nd" lists for child elements (see convert_osm_2_json in 3_json.py).
+Records are written one per line in compact JSON, optionally gzip-compressed,
+so that both writing and reading run in constant memory.
+"""
+import gzip
+import json
+
+from bson import json_util
+
+from cleaning import parse_timestamp
+from osm_stream import iter_elements
+
+
+def shape_record(element, converter=None):
+    """
+    Shapes a top level element into a record, visiting each child once.
+
+    Args:
+        element: An Element object of "bounds", "node", "way" or "relation".
+        converter: A DtypeConverter object which converts attribute values.
+                   None keeps them as they are in the element.
+    Returns:
+        A dict of the record.
+    """
+    tag = element.tag
+    if converter is None:
+        record = dict(element.attrib)
+    else:
+        id_ = element.get("id")
+        record = converter.convert(tag, element.attrib, id_)
+    record["xml"] = tag
+    if "lat" in record and "lon" in record:
+        # [longitude, latitude] for a 2dsphere index
+        try:
+            record["pos"] = [float(record["lon"]), float(record["lat"])]
+        except ValueError:
+            pass
+    tags = []
+    members = []
+    nds = []
+    for child in element:
+        if converter is None:
+            attrib = dict(child.attrib)
+        else:
+            attrib = converter.convert(tag + "/" + child.tag, child.attrib, id_)
+        if child.tag == "tag":
+            tags.append(attrib)
+        elif child.tag == "nd":
+            nds.append(attrib.get("ref"))
+        elif child.tag == "member":
+            members.append(attrib)
+    if nds:
+        record["nd"] = nds
+    if tags:
+        record["tag"] = tags
+    if members:
+        record["member"] = members
+    return record
+
+
+def shape_root(root):
+    """
+    Shapes the root "osm" element into a record (without children).
+    """
+    record = dict(root.attrib)
+    if isinstance(record.get("timestamp"), basestring):
+        record["timestamp"] = parse_timestamp(record["timestamp"])
+    record["xml"] = root.tag
+    return record
+
+
+def records_from_file(osm_file, converter=None):
+    """
+    Yields records of the root and all elements under the root,
+    streaming over an OSM XML file.
+    """
+    elements = iter_elements(osm_file, None, root=True)
+    yield shape_root(next(elements))
+    for elem in elements:
+        yield shape_record(elem, converter)
+
+
+def open_json_lines(filename, mode):
+    """
+    Opens a JSON Lines file. Files ending with ".gz" are gzip-compressed.
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, mode + "b")
+    return open(filename, mode)
+
+
+def write_json_lines(records, filename):
+    """
+    Writes records into a JSON Lines file.
+
+    Args:
+        records: An iterable of record dicts.
+        filename: A file name outputted. Ends with ".gz" to compress.
+    Returns:
+        Number of records written.
+    """
+    count = 0
+    with open_json_lines(filename, "w") as f:
+        for record in records:
+            f.write(json.dumps(record, default=json_util.default, separators=(',', ':')))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def read_json_lines(filename):
+    """
+    Yields records from a JSON Lines file written by write_json_lines.
+    """
+    with open_json_lines(filename, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line, object_hook=json_util.object_hook)
@@ -0,0 +1,430 @@
+"""
+Streaming helpers for OSM XML files.
+
+All functions here read the file with iterparse and clear every top level
+element (node, way, relation) once it has been handled, so memory stays
+bounded regardless of the size of the extract.
+"""
+import bz2
+import xml.etree.cElementTree as ET
+from collections import Counter, defaultdict
+import gzip
+from multiprocessing import Pool, cpu_count
+import os
+import re
+
+# Top level elements directly under the root "osm"
+TOP_LEVEL = ('bounds', 'node', 'way', 'relation')
+
+# Start of a top level element in raw XML.
+# These tags never appear below the top level and "<" cannot appear
+# unescaped in attribute values, so any match is an element boundary.
+TOP_LEVEL_START = re.compile(r'<(?:bounds|node|way|relation)[\s/>]')
+
+
+def iter_elements(osm_file, tags=('node', 'way', 'relation'), root=False):
+    """
+    Yields top level elements of the specified tags with their children.
+    Each element is cleared from the root after it has been yielded.
+
+    Args:
+        osm_file: A file name or file object of OSM XML.
+        tags: Tag names of top level elements yielded. None yields all of them.
+        root: Yields the root element first (with its attributes only).
+    Yields:
+        An Element object of a top level element.
+    """
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root_elem = next(context)
+    if root:
+        yield root_elem
+    depth = 0
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            if tags is None or elem.tag in tags:
+                yield elem
+            root_elem.clear()
+
+
+def open_osm_input(filename):
+    """
+    Opens an OSM XML file for reading.
+    Files ending with ".gz" are gzip-compressed and ".bz2" bzip2-compressed.
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rb")
+    if filename.endswith(".bz2"):
+        return bz2.BZ2File(filename, "rb")
+    return open(filename, "rb")
+
+
+class OsmProfile(object):
+    """
+    Summary of an OSM XML file collected in a single streaming pass.
+
+    Attributes:
+        root_attrib: A dict of attributes of the root "osm" element.
+        tags: A Counter of all tag names.
+        structure: A hierarchical list [int, dict] of the count of each tag
+                   and its child tags, like {"osm": [1, {"node": [n, {...}]}]}.
+        attributes: A dict {path: Counter of attribute names}.
+                    path is like "node" or "node/tag".
+        keys: A dict {path: Counter of "k(ey)"} for "*/tag" paths.
+        values: A dict {(path, k): Counter of "v(alue)"} for "*/tag" paths.
+        samples: A dict {path: list of attribute dicts} of the first elements.
+    """
+    def __init__(self):
+        self.root_attrib = {}
+        self.tags = Counter()
+        self.structure = [1, {}]
+        self.attributes = defaultdict(Counter)
+        self.keys = defaultdict(Counter)
+        self.values = defaultdict(Counter)
+        self.samples = defaultdict(list)
+
+    def count_k(self, path):
+        """
+        Returns a list of tuples (count, k) in descending order of count.
+        path is like "node/tag".
+        """
+        return sorted([(cnt, k) for (k, cnt) in self.keys[path].items()],
+                      reverse=True)
+
+    def count_v(self, path, k):
+        """
+        Returns a list of tuples (count, v) in descending order of count.
+        Only */tag elements with the key k are counted.
+        """
+        return sorted([(cnt, v) for (v, cnt) in self.values[(path, k)].items()],
+                      reverse=True)
+
+    def count_attributes(self, path):
+        """
+        Returns a dict of attribute name and count of the path.
+        """
+        return dict(self.attributes[path])
+
+    def merge(self, other, n_samples=3):
+        """
+        Adds counts of another profile (e.g. of another shard) to this one.
+        Samples of this profile come first.
+        """
+        self.tags.update(other.tags)
+        _merge_structure(self.structure[1], other.structure[1])
+        for path, counter in other.attributes.items():
+            self.attributes[path].update(counter)
+        for path, counter in other.keys.items():
+            self.keys[path].update(counter)
+        for key, counter in other.values.items():
+            self.values[key].update(counter)
+        for path, samples in other.samples.items():
+            need = n_samples - len(self.samples[path])
+            if need > 0:
+                self.samples[path].extend(samples[:need])
+        return self
+
+
+def _merge_structure(children, other):
+    """
+    Adds child elements {tag: [int, dict]} of a structure into another.
+    """
+    for tag, (count, grandchildren) in other.items():
+        if tag in children:
+            children[tag][0] += count
+            _merge_structure(children[tag][1], grandchildren)
+        else:
+            children[tag] = [count, grandchildren]
+
+
+def profile_osm(osm_file, value_keys=None, n_samples=3, reducer=None):
+    """
+    Counts tags, structure, attributes and k/v of "*/tag" in one pass.
+
+    Args:
+        osm_file: A file name or file object of OSM XML.
+        value_keys: A collection of "k(ey)" whose "v(alue)" are counted.
+                    None counts values of all keys.
+        n_samples: Number of sample attribute dicts kept per path.
+        reducer: A Reducer which visits every top level element in the same pass.
+    Returns:
+        An OsmProfile object.
+    """
+    prof = OsmProfile()
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    prof.root_attrib = dict(root.attrib)
+    prof.tags[root.tag] += 1
+    prof.structure[1][root.tag] = [1, {}]
+
+    nodes = [prof.structure[1][root.tag]]
+    paths = ['']
+    for event, elem in context:
+        if event == 'end':
+            nodes.pop()
+            paths.pop()
+            if len(paths) == 1:
+                if reducer is not None:
+                    reducer.visit(elem)
+                root.clear()
+            continue
+
+        tag = elem.tag
+        prof.tags[tag] += 1
+        # Structure tree
+        children = nodes[-1][1]
+        if tag in children:
+            node = children[tag]
+            node[0] += 1
+        else:
+            node = children[tag] = [1, {}]
+        nodes.append(node)
+        # Attributes
+        path = paths[-1] + '/' + tag if paths[-1] else tag
+        paths.append(path)
+        attrib = elem.attrib
+        prof.attributes[path].update(attrib.keys())
+        if len(prof.samples[path]) < n_samples:
+            prof.samples[path].append(dict(attrib))
+        # k/v of */tag
+        if tag == 'tag':
+            k = attrib.get('k')
+            prof.keys[path][k] += 1
+            if value_keys is None or k in value_keys:
+                prof.values[(path, k)][attrib.get('v')] += 1
+    return prof
+
+
+def _find_next(f, offset, chunk_size=1 << 16):
+    """
+    Returns byte offset of the first top level element at or after offset,
+    or None if there is no more.
+    """
+    f.seek(offset)
+    carry = ''
+    pos = offset
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            return None
+        buf = carry + data
+        m = TOP_LEVEL_START.search(buf)
+        if m:
+            return pos - len(carry) + m.start()
+        carry = buf[-16:]
+        pos += len(data)
+
+
+def find_shards(osm_file, n_shards):
+    """
+    Splits an OSM XML file into byte ranges at top level element boundaries.
+
+    Args:
+        osm_file: A file name of OSM XML.
+        n_shards: Number of shards wanted. Fewer are returned for small files.
+    Returns:
+        A list of tuples (start, end) of byte offsets.
+    """
+    size = os.path.getsize(osm_file)
+    with open(osm_file, 'rb') as f:
+        first = _find_next(f, 0)
+        if first is None:
+            return []
+        tail_start = max(first, size - 4096)
+        f.seek(tail_start)
+        end = tail_start + f.read().rfind('</osm>')
+        cuts = [first]
+        for i in xrange(1, n_shards):
+            offset = _find_next(f, max(first, size * i // n_shards))
+            if offset is not None and cuts[-1] < offset < end:
+                cuts.append(offset)
+        cuts.append(end)
+    return zip(cuts[:-1], cuts[1:])
+
+
+class ShardFile(object):
+    """
+    File-like object which reads a byte range of an OSM XML file
+    wrapped in its own root element, so that it can be parsed by iterparse.
+    """
+    def __init__(self, osm_file, start, end):
+        self.f = open(osm_file, 'rb')
+        self.f.seek(start)
+        self.remaining = end - start
+        self.head = '<osm>\n'
+        self.tail = '</osm>\n'
+
+    def read(self, size=-1):
+        if self.head:
+            data, self.head = self.head, ''
+            return data
+        if self.remaining > 0:
+            if size < 0 or size > self.remaining:
+                size = self.remaining
+            data = self.f.read(size)
+            self.remaining = self.remaining - len(data) if data else 0
+            if data:
+                return data
+        if self.tail:
+            self.f.close()
+            data, self.tail = self.tail, ''
+            return data
+        return ''
+
+
+class Reducer(object):
+    """
+    Base of mergeable reducers run over top level elements of each shard.
+    Subclasses must be defined at module level so that they can be pickled.
+    """
+    def visit(self, element):
+        raise NotImplementedError
+
+    def merge(self, other):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class TagCounter(Reducer):
+    """
+    Counts tags of top level elements and their children.
+    """
+    def __init__(self):
+        self.tags = Counter()
+
+    def visit(self, element):
+        for e in element.iter():
+            self.tags[e.tag] += 1
+
+    def merge(self, other):
+        self.tags.update(other.tags)
+        return self
+
+    def result(self):
+        return self.tags
+
+
+class AttributeSet(Reducer):
+    """
+    Collects distinct values of an attribute of top level elements.
+    """
+    def __init__(self, attr):
+        self.attr = attr
+        self.values = set()
+
+    def visit(self, element):
+        val = element.get(self.attr)
+        if val is not None:
+            self.values.add(val)
+
+    def merge(self, other):
+        self.values |= other.values
+        return self
+
+    def result(self):
+        return self.values
+
+
+class ValueHistogram(Reducer):
+    """
+    Counts "v(alue)" of "*/tag" per (path, k) for the keys specified.
+    """
+    def __init__(self, keys):
+        self.keys = frozenset(keys)
+        self.values = defaultdict(Counter)
+
+    def visit(self, element):
+        path = element.tag + '/tag'
+        for tag in element.iter('tag'):
+            k = tag.get('k')
+            if k in self.keys:
+                self.values[(path, k)][tag.get('v')] += 1
+
+    def merge(self, other):
+        for key, counter in other.values.items():
+            self.values[key].update(counter)
+        return self
+
+    def result(self):
+        return self.values
+
+
+def _reduce_shard(args):
+    osm_file, start, end, factory, tags = args
+    reducer = factory()
+    for element in iter_elements(ShardFile(osm_file, start, end), tags):
+        reducer.visit(element)
+    return reducer
+
+
+def _profile_shard(args):
+    osm_file, start, end, value_keys, factory = args
+    reducer = factory() if factory is not None else None
+    return profile_osm(ShardFile(osm_file, start, end), value_keys, reducer=reducer), reducer
+
+
+def _map_shards(func, osm_file, args, workers, n_shards):
+    workers = workers or cpu_count()
+    shards = find_shards(osm_file, n_shards or workers * 4)
+    pool = Pool(workers)
+    try:
+        return pool.map(func, [(osm_file, start, end) + args for (start, end) in shards])
+    finally:
+        pool.close()
+        pool.join()
+
+
+def map_shards(osm_file, factory, tags=('node', 'way', 'relation'),
+               workers=None, n_shards=None):
+    """
+    Runs a reducer over top level elements of shards in a process pool
+    and merges the results in file order.
+
+    Args:
+        osm_file: A file name of OSM XML.
+        factory: A picklable callable returning a new Reducer
+                 (a Reducer class, or functools.partial of it).
+        tags: Tag names of top level elements visited.
+        workers: Number of processes. Defaults to the number of CPUs.
+        n_shards: Number of shards. Defaults to 4 per process.
+    Returns:
+        The merged Reducer.
+    """
+    reducers = _map_shards(_reduce_shard, osm_file, (factory, tags), workers, n_shards)
+    merged = factory()
+    for reducer in reducers:
+        merged.merge(reducer)
+    return merged
+
+
+def profile_osm_sharded(osm_file, value_keys=None, workers=None, n_shards=None,
+                        factory=None):
+    """
+    Same as profile_osm, parsing shards of the file in a process pool.
+
+    Args:
+        factory: A picklable callable returning a new Reducer which visits
+                 top level elements of each shard in the same pass (see map_shards).
+    Returns:
+        An OsmProfile object, or a tuple (OsmProfile, merged Reducer) with factory.
+    """
+    prof = OsmProfile()
+    merged = factory() if factory is not None else None
+    for shard, reducer in _map_shards(_profile_shard, osm_file, (value_keys, factory),
+                                      workers, n_shards):
+        prof.merge(shard)
+        if merged is not None:
+            merged.merge(reducer)
+    # Each shard has its own root, while the file has only one
+    _, root = next(ET.iterparse(osm_file, events=('start',)))
+    prof.root_attrib = dict(root.attrib)
+    prof.tags[root.tag] = 1
+    prof.structure[1][root.tag][0] = 1
+    if merged is not None:
+        return prof, merged
+    return prof
@@ -0,0 +1,63 @@
+"""
+Streaming writer of cleaned OSM XML.
+
+Top level elements are cleaned by a pipeline while the input is read with
+iterparse and written with ET.tostring one at a time (as in 9_sample_data.py),
+so neither the input nor the output tree is ever held in memory.
+"""
+import bz2
+import gzip
+import xml.etree.cElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+from osm_stream import iter_elements
+
+
+def open_osm_output(filename):
+    """
+    Opens an OSM XML file for writing.
+    Files ending with ".gz" are gzip-compressed and ".bz2" bzip2-compressed.
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "wb")
+    if filename.endswith(".bz2"):
+        return bz2.BZ2File(filename, "wb")
+    return open(filename, "wb")
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _start_tag(element):
+    attrs = "".join([" %s=%s" % (k, _encode(quoteattr(v))) for k, v in element.items()])
+    return "<%s%s>\n" % (element.tag, attrs)
+
+
+def write_cleaned_osm(osm_file, filename, pipeline=None):
+    """
+    Writes an OSM XML file with stages of a pipeline applied to every
+    top level element, streaming over the input.
+
+    Args:
+        osm_file: A file name or file object of OSM XML read.
+        filename: A file name outputted. Ends with ".gz" or ".bz2" to compress.
+        pipeline: A pipeline.Pipeline object. None copies elements as they are.
+    Returns:
+        Number of top level elements written.
+    """
+    elements = iter_elements(osm_file, None, root=True)
+    root = next(elements)
+
+    count = 0
+    with open_osm_output(filename) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(_start_tag(root))
+        cleaned = elements if pipeline is None else pipeline.process(elements)
+        for element in cleaned:
+            f.write(ET.tostring(element, encoding='utf-8'))
+            count += 1
+        f.write('</%s>\n' % root.tag)
+    return count
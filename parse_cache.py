@@ -0,0 +1,214 @@
+"""
+Persistent cache of parse results of an OSM XML file.
+
+Results are kept in a directory next to the file ("<file>.cache") in
+binary form (NumPy .npy files loaded memory-mapped, or pickles) with a
+manifest of the size, mtime and a hash of the file they were built from.
+When the file changes, the entries listed in the manifest are removed and
+rebuilt on the next access. A directory without a manifest is never used.
+"""
+from array import array
+import cPickle as pickle
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from columns import to_numpy
+from grid_index import GridIndex
+from node_store import NodeStore, build_node_store
+from osm_index import IdIndex, build_id_index
+from osm_stream import profile_osm_sharded
+from tag_store import TagStore, TagStoreBuilder, build_tag_store
+from way_store import WayStore, build_way_store
+
+MANIFEST = "manifest.json"
+
+# Bytes hashed at the head and the tail of the file
+HASH_BLOCK = 1 << 20
+
+
+def file_key(osm_file, full_hash=False):
+    """
+    Returns a dict of size, mtime and sha1 which identifies the file content.
+    By default only the head and the tail of the file are hashed.
+    """
+    stat = os.stat(osm_file)
+    sha1 = hashlib.sha1()
+    with open(osm_file, 'rb') as f:
+        if full_hash or stat.st_size <= 2 * HASH_BLOCK:
+            for block in iter(lambda: f.read(HASH_BLOCK), ''):
+                sha1.update(block)
+        else:
+            sha1.update(f.read(HASH_BLOCK))
+            f.seek(-HASH_BLOCK, os.SEEK_END)
+            sha1.update(f.read(HASH_BLOCK))
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": sha1.hexdigest()}
+
+
+def _save_pickle(obj, path):
+    with open(path, 'wb') as f:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+
+
+def _load_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _save_tag_store(store, path):
+    store.save(path)
+
+
+def _save_id_index(index, path):
+    os.makedirs(path)
+    for tag, idx in index.items():
+        np.save(os.path.join(path, tag + ".npy"), to_numpy(idx.ids, np.int64))
+
+
+def _load_id_index(path):
+    index = {}
+    for name in os.listdir(path):
+        idx = IdIndex()
+        idx.ids = array('l', np.load(os.path.join(path, name)).tostring())
+        index[name[:-len(".npy")]] = idx
+    return index
+
+
+class ParseCache(object):
+    """
+    Cache directory of parse results of an OSM XML file.
+
+    Args:
+        osm_file: A file name of OSM XML.
+        directory: A cache directory. Defaults to "<osm_file>.cache".
+        full_hash: Hash the whole file instead of its head and tail.
+    """
+    def __init__(self, osm_file, directory=None, full_hash=False):
+        self.osm_file = osm_file
+        self.directory = directory or osm_file + ".cache"
+        self.key = file_key(osm_file, full_hash)
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get("key") == self.key:
+                return manifest
+            # The file has changed: remove only the entries of the manifest
+            for name in manifest.get("entries", ()):
+                self._remove(name)
+            os.remove(path)
+        elif os.path.isdir(self.directory):
+            if os.listdir(self.directory):
+                raise ValueError("Not a cache directory (no %s): %s"
+                                 % (MANIFEST, self.directory))
+        else:
+            os.makedirs(self.directory)
+        return {"key": self.key, "entries": []}
+
+    def _remove(self, name):
+        # Entries are plain names directly under the cache directory
+        if not name or os.path.basename(name) != name:
+            return
+        path = os.path.join(self.directory, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def _write_manifest(self):
+        with open(os.path.join(self.directory, MANIFEST), 'w') as f:
+            json.dump(self.manifest, f)
+
+    def get(self, name, build, save, load):
+        """
+        Returns a cached entry, building and saving it if it does not exist.
+
+        Args:
+            name: A file or directory name of the entry in the cache directory.
+            build: A function with no argument which builds the entry.
+            save: A function (entry, path) which saves the entry.
+            load: A function (path) which loads the entry.
+        """
+        if name in self.manifest["entries"]:
+            return load(os.path.join(self.directory, name))
+        entry = build()
+        self.put(name, entry, save)
+        return entry
+
+    def put(self, name, entry, save):
+        """
+        Saves an entry built along with another one, replacing the old one.
+        """
+        self._remove(name)
+        save(entry, os.path.join(self.directory, name))
+        self.manifest["entries"].append(name)
+        self._write_manifest()
+
+    def profile(self, workers=None):
+        """
+        Returns an OsmProfile of the file (see osm_stream.profile_osm).
+        "v(alue)" are not counted in the profile; use tag_store().count_v.
+        The tag store is built in the same sharded pass if it is not cached.
+        """
+        return self.get("profile.pickle", lambda: self._build_profile(workers),
+                        _save_pickle, _load_pickle)
+
+    def _build_profile(self, workers):
+        if "tags" in self.manifest["entries"]:
+            return profile_osm_sharded(self.osm_file, value_keys=(), workers=workers)
+        prof, builder = profile_osm_sharded(self.osm_file, value_keys=(), workers=workers,
+                                            factory=TagStoreBuilder)
+        self.put("tags", builder.result(), _save_tag_store)
+        return prof
+
+    def tag_store(self, workers=None):
+        """
+        Returns a TagStore of the file with code arrays memory-mapped.
+        Shards of the file are parsed in a process pool when it is not cached.
+        """
+        return self.get("tags",
+                        lambda: build_tag_store(self.osm_file, workers),
+                        _save_tag_store, TagStore.load)
+
+    def node_store(self):
+        """
+        Returns a NodeStore of the file with columns memory-mapped.
+        """
+        return self.get("nodes",
+                        lambda: build_node_store(self.osm_file),
+                        lambda store, path: store.save(path),
+                        NodeStore.load)
+
+    def id_index(self, workers=None):
+        """
+        Returns id indexes {tag: IdIndex} of the file.
+        """
+        return self.get("ids",
+                        lambda: build_id_index(self.osm_file, workers),
+                        _save_id_index, _load_id_index)
+
+    def grid_index(self, cell_size=0.005):
+        """
+        Returns a GridIndex over coordinates of the node store.
+        """
+        store = self.node_store()
+        return self.get("grid-%g" % cell_size,
+                        lambda: GridIndex.build(store.lat, store.lon, store.bounds, cell_size),
+                        lambda grid, path: grid.save(path),
+                        lambda path: GridIndex.load(path, store.lat, store.lon))
+
+    def way_store(self):
+        """
+        Returns a WayStore of the file joined with coordinates of the node store.
+        """
+        store = self.node_store()
+        return self.get("ways",
+                        lambda: build_way_store(self.osm_file).join(store.id, store.lat, store.lon),
+                        lambda ways, path: ways.save(path),
+                        WayStore.load)
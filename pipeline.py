@@ -0,0 +1,305 @@
+"""
+Declarative cleaning pipeline over OSM XML.
+
+Each cleaner is a Stage declaring the parent types and the "k(ey)" of the
+*/tag elements it reads. A Pipeline dispatches every top level element to
+the stages registered for its type and keys, so all stages run in a single
+traversal of a tree or of a file streamed with iterparse, instead of one
+findall and one pass per cleaner. Stages can be run alone, reordered or
+left out by name.
+"""
+from collections import Counter, OrderedDict, defaultdict
+import time
+
+from cleaning import NameRuleEngine, PostcodeValidator, ValueCleaner
+from cleaning import remove_non_numeric_chars
+from cleaning import NAME_ABBREVIATIONS, NAME_FRANCHISES, POSTCODE_RULES
+from osm_stream import iter_elements
+
+
+class Stage(object):
+    """
+    A cleaning step of top level elements.
+
+    Attributes:
+        name: A unique name of the stage.
+        parents: Tag names of parent elements, e.g. ("node", "way").
+        key: "k(ey)" of */tag elements processed, or None for the element itself.
+        log: A dict {parent type: list of changes}.
+    """
+    def __init__(self, name, parents, key=None):
+        self.name = name
+        self.parents = tuple(parents)
+        self.key = key
+        self.log = defaultdict(list)
+
+    def reset(self):
+        """
+        Clears the state kept from a previous run (logs, caches and counts).
+        """
+        self.log = defaultdict(list)
+
+    def process_tag(self, parent, tag):
+        """
+        Processes a */tag element with the key.
+        Returns False to remove the tag from the parent, True to keep it.
+        """
+        return True
+
+    def process_element(self, element):
+        """
+        Processes a parent element (stages without a key).
+        """
+        pass
+
+
+class ValueStage(Stage):
+    """
+    Replaces "v(alue)" of */tag elements with func(v) through a ValueCleaner,
+    so results are memoized per distinct value. Changes are logged as (before, after).
+    With record, func returns (value, changes) and record(changes) is called
+    on every tag, whether the result was cached or not.
+    """
+    def __init__(self, name, parents, key, func, maxsize=100000, record=None):
+        Stage.__init__(self, name, parents, key)
+        self.cleaner = ValueCleaner(func, maxsize, record)
+
+    def process_tag(self, parent, tag):
+        bef = tag.get("v")
+        aft = self.cleaner.clean_value(bef)
+        if aft != bef:
+            tag.set("v", aft)
+            self.log[parent.tag].append((bef, aft))
+        return True
+
+    def reset(self):
+        Stage.reset(self)
+        self.cleaner.reset()
+
+    def stats(self):
+        """
+        Returns the stats of the cache (see ValueCleaner.stats).
+        """
+        return self.cleaner.stats()
+
+
+class RuleStage(ValueStage):
+    """
+    Standardizes "v(alue)" of */tag elements with a NameRuleEngine.
+    Hits and changes per rule are kept in the engine for every tag.
+    """
+    def __init__(self, name, parents, key, engine, maxsize=100000):
+        ValueStage.__init__(self, name, parents, key, engine.evaluate, maxsize,
+                            engine.record)
+        self.engine = engine
+
+    def reset(self):
+        ValueStage.reset(self)
+        self.engine.reset()
+
+
+class FilterStage(Stage):
+    """
+    Removes */tag elements whose "v(alue)" does not satisfy keep(v).
+    Removed values are logged.
+    """
+    def __init__(self, name, parents, key, keep):
+        Stage.__init__(self, name, parents, key)
+        self.keep = keep
+
+    def process_tag(self, parent, tag):
+        v = tag.get("v")
+        if self.keep(v):
+            return True
+        self.log[parent.tag].append(v)
+        return False
+
+
+class CountStage(Stage):
+    """
+    Counts "v(alue)" of */tag elements left by the stages registered before it.
+
+    Attributes:
+        counts: A dict {parent type: Counter of v}.
+    """
+    def __init__(self, name, parents, key):
+        Stage.__init__(self, name, parents, key)
+        self.counts = defaultdict(Counter)
+
+    def reset(self):
+        Stage.reset(self)
+        self.counts = defaultdict(Counter)
+
+    def process_tag(self, parent, tag):
+        self.counts[parent.tag][tag.get("v")] += 1
+        return True
+
+    def count_v(self, parent_type):
+        """
+        Returns a list of tuples (count, v) in descending order of count
+        (same as TagStore.count_v).
+        """
+        return sorted([(cnt, v) for (v, cnt) in self.counts[parent_type].items()],
+                      reverse=True)
+
+
+def _remove_child(parent, child):
+    """
+    Removes a child keeping the indentation of the following one.
+    """
+    children = list(parent)
+    i = children.index(child)
+    if i > 0:
+        children[i - 1].tail = child.tail
+    else:
+        parent.text = child.tail
+    parent.remove(child)
+
+
+class Pipeline(object):
+    """
+    Runs stages in a single traversal of top level elements.
+    On each */tag element, stages with its parent type and key run in the
+    order they were registered until one of them removes the tag.
+    Stages without a key run on the element after its tags.
+
+    Args:
+        stages: A list of Stage objects.
+        profiler: A stage_profile.StageProfiler object. Time and number of
+                  calls of each stage are recorded as "<name>/<stage name>".
+        name: A name of the pipeline in the profiler.
+    """
+    def __init__(self, stages=(), profiler=None, name="pipeline"):
+        self.stages = OrderedDict()
+        self.profiler = profiler
+        self.name = name
+        for stage in stages:
+            self.register(stage)
+
+    def register(self, stage):
+        if stage.name in self.stages:
+            raise ValueError("Stage already registered: %s" % stage.name)
+        self.stages[stage.name] = stage
+        return stage
+
+    def __getitem__(self, name):
+        return self.stages[name]
+
+    def select(self, names):
+        """
+        Returns a pipeline of the named stages in the given order.
+        The stages are shared with this pipeline and reset, so their logs,
+        caches and counts are of the next run only.
+        """
+        stages = [self.stages[name] for name in names]
+        for stage in stages:
+            stage.reset()
+        return Pipeline(stages, self.profiler, self.name)
+
+    def _timed(self, func, name, timings):
+        """
+        Wraps a method of a stage adding its time and calls to timings[name].
+        """
+        def wrapper(*args):
+            start = time.time()
+            result = func(*args)
+            timing = timings[name]
+            timing[0] += time.time() - start
+            timing[1] += 1
+            return result
+        return wrapper
+
+    def _dispatch(self, timings=None):
+        """
+        Returns methods of stages by parent type (and key).
+        They are timed into timings {stage name: [seconds, calls]} if given.
+        """
+        tag_stages = defaultdict(lambda: defaultdict(list))
+        element_stages = defaultdict(list)
+        for stage in self.stages.values():
+            func = stage.process_tag if stage.key is not None else stage.process_element
+            if timings is not None:
+                func = self._timed(func, stage.name, timings)
+            for parent in stage.parents:
+                if stage.key is None:
+                    element_stages[parent].append(func)
+                else:
+                    tag_stages[parent][stage.key].append(func)
+        return tag_stages, element_stages
+
+    def _record(self, timings):
+        for stage_name in self.stages:
+            if stage_name in timings:
+                seconds, calls = timings[stage_name]
+                self.profiler.record("%s/%s" % (self.name, stage_name), seconds, calls)
+
+    def process(self, elements):
+        """
+        Applies stages to top level elements and yields each of them.
+
+        Args:
+            elements: An iterable of top level Element objects.
+        Yields:
+            Cleaned elements. Changes are directly reflected in the elements.
+        """
+        timings = None
+        if self.profiler is not None:
+            timings = defaultdict(lambda: [0.0, 0])
+        tag_stages, element_stages = self._dispatch(timings)
+        try:
+            for element in elements:
+                by_key = tag_stages.get(element.tag)
+                if by_key:
+                    removed = []
+                    for tag in element.findall("tag"):
+                        for process_tag in by_key.get(tag.get("k"), ()):
+                            if not process_tag(element, tag):
+                                removed.append(tag)
+                                break
+                    for tag in removed:
+                        _remove_child(element, tag)
+                for process_element in element_stages.get(element.tag, ()):
+                    process_element(element)
+                yield element
+        finally:
+            if timings is not None:
+                self._record(timings)
+
+    def run(self, source):
+        """
+        Runs all stages over a tree in place, or over a file.
+
+        Args:
+            source: An ElementTree object, or a file name of OSM XML.
+                    A file is streamed and cleaned elements are discarded,
+                    which is useful for the logs only (see process() to
+                    consume elements, or osm_writer.write_cleaned_osm).
+        Returns:
+            Number of top level elements processed.
+        """
+        if isinstance(source, basestring):
+            elements = iter_elements(source, ('bounds', 'node', 'way', 'relation'))
+        else:
+            elements = iter(source.getroot())
+        n = 0
+        for _ in self.process(elements):
+            n += 1
+        return n
+
+
+def cleaning_stages(postcode_rule=POSTCODE_RULES["SG"]):
+    """
+    Returns the stages of 2_check_clean.py in order:
+    names (capitalization, abbreviations and franchises of node names in a
+    single NameRuleEngine), and non-numeric characters and validity of
+    postal codes of nodes and ways.
+    Values are kept as strings; data types are converted per record when
+    shaping JSON (see osm_json.shape_record).
+    """
+    stages = [RuleStage("names", ("node",), "name",
+                        NameRuleEngine(NAME_ABBREVIATIONS + NAME_FRANCHISES)),
+              ValueStage("postcode_digits", ("node", "way"), "addr:postcode",
+                         remove_non_numeric_chars),
+              FilterStage("postcode_validity", ("node", "way"), "addr:postcode",
+                          PostcodeValidator(*postcode_rule).is_valid)]
+    return stages
@@ -0,0 +1,201 @@
+"""
+Per-stage timing of the cleaning and conversion steps.
+
+Functions are wrapped with profiled() and blocks of a script with stage().
+Each stage records wall time, number of elements processed and calls, and
+optionally cProfile statistics and peak RSS growth (tracemalloc does not
+exist in Python 2, so memory is measured with resource.getrusage).
+Set the environment variable STAGE_PROFILE to "cprofile", "memory" or
+"cprofile,memory" to turn the options on for the default PROFILER.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import cProfile
+from functools import wraps
+import os
+import pstats
+import resource
+from StringIO import StringIO
+import time
+
+
+class StageStats(object):
+    """
+    Attributes:
+        name: A stage name.
+        calls: Number of times the stage ran.
+        seconds: Total wall time.
+        elements: Total number of elements processed (None if not counted).
+        rss_kb: Largest growth of peak RSS in kilobytes (None if not measured).
+        profile: A pstats.Stats object of all calls (None without cProfile).
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.elements = None
+        self.rss_kb = None
+        self.profile = None
+
+    def add_elements(self, n):
+        self.elements = (self.elements or 0) + n
+
+    def elements_per_sec(self):
+        if self.elements is None or self.seconds <= 0:
+            return None
+        return self.elements / self.seconds
+
+
+def _peak_rss_kb():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _count_first_arg(args, kwargs, result):
+    """
+    Default element count: length of the first argument (e.g. a list of */tag).
+    """
+    try:
+        return len(args[0])
+    except (IndexError, TypeError):
+        return None
+
+
+def count_result(args, kwargs, result):
+    """
+    Element count of functions which return the number of elements processed.
+    """
+    return result
+
+
+class StageProfiler(object):
+    """
+    Collects StageStats by stage name in the order stages first ran.
+
+    Args:
+        cprofile: Runs each stage under cProfile.
+        memory: Records growth of peak RSS of each stage.
+    """
+    def __init__(self, cprofile=False, memory=False):
+        self.cprofile = cprofile
+        self.memory = memory
+        self.stages = OrderedDict()
+
+    @classmethod
+    def from_env(cls, variable="STAGE_PROFILE"):
+        options = os.environ.get(variable, "").split(",")
+        return cls(cprofile="cprofile" in options, memory="memory" in options)
+
+    def _stats(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats(name)
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name, elements=None):
+        """
+        Context manager timing a block as a stage.
+        Yields the StageStats, so that elements can be added in the block
+        with add_elements() when they are not known beforehand.
+        """
+        stats = self._stats(name)
+        if elements is not None:
+            stats.add_elements(elements)
+        profile = cProfile.Profile() if self.cprofile else None
+        rss = _peak_rss_kb() if self.memory else None
+        start = time.time()
+        if profile:
+            profile.enable()
+        try:
+            yield stats
+        finally:
+            if profile:
+                profile.disable()
+            stats.seconds += time.time() - start
+            stats.calls += 1
+            if rss is not None:
+                stats.rss_kb = max(stats.rss_kb or 0, _peak_rss_kb() - rss)
+            if profile:
+                if stats.profile is None:
+                    stats.profile = pstats.Stats(profile)
+                else:
+                    stats.profile.add(profile)
+
+    def record(self, name, seconds, elements=None):
+        """
+        Adds a run of a stage timed by the caller, e.g. a step called per
+        element whose time is summed up outside of stage().
+        """
+        stats = self._stats(name)
+        stats.seconds += seconds
+        stats.calls += 1
+        if elements is not None:
+            stats.add_elements(elements)
+        return stats
+
+    def profiled(self, name=None, count=_count_first_arg):
+        """
+        Decorator running a function as a stage.
+
+        Args:
+            name: A stage name. Defaults to the function name.
+            count: A function (args, kwargs, result) returning the number of
+                   elements processed, or None. Defaults to len(args[0]).
+        """
+        def decorator(func):
+            stage_name = name or func.__name__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name) as stats:
+                    result = func(*args, **kwargs)
+                n = count(args, kwargs, result) if count else None
+                if n is not None:
+                    stats.add_elements(n)
+                return result
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """
+        Returns a table of stages as a string.
+        """
+        lines = ["%-32s %6s %10s %10s %14s %10s" % ("stage", "calls", "seconds",
+                                                    "elements", "elements/sec", "rss_kb")]
+        for stats in self.stages.values():
+            rate = stats.elements_per_sec()
+            lines.append("%-32s %6d %10.3f %10s %14s %10s" % (
+                stats.name, stats.calls, stats.seconds,
+                "-" if stats.elements is None else stats.elements,
+                "-" if rate is None else "%.0f" % rate,
+                "-" if stats.rss_kb is None else stats.rss_kb))
+        return "\n".join(lines)
+
+    def profile_report(self, limit=15, sort="cumulative"):
+        """
+        Returns cProfile statistics of each stage as a string.
+        """
+        out = StringIO()
+        for stats in self.stages.values():
+            if stats.profile is None:
+                continue
+            out.write("=== %s ===\n" % stats.name)
+            stats.profile.stream = out
+            stats.profile.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def report(self, path):
+        """
+        Returns the summary table and writes cProfile statistics of each
+        stage into a file if cprofile is on. Called at the end of each script.
+        """
+        if self.cprofile:
+            with open(path, 'w') as f:
+                f.write(self.profile_report())
+        return self.summary()
+
+
+# Profiler shared by the scripts
+PROFILER = StageProfiler.from_env()
+stage = PROFILER.stage
+profiled = PROFILER.profiled
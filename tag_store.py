@@ -0,0 +1,247 @@
+"""
+Dictionary-encoded store of */tag elements and users.
+
+Keys, values and user names repeat across hundreds of thousands of
+elements. Each distinct string is held once in a StringTable and every
+occurrence is a small integer code in a NumPy array, and strings are
+decoded on demand. Tags are also indexed by (parent, key) offsets, so
+counting keys or the values of one key reads only the matching tags.
+"""
+import cPickle as pickle
+import os
+
+import numpy as np
+
+from columns import columns_to_numpy, new_buffers
+from osm_stream import Reducer, iter_elements, map_shards
+
+# Codes of parent element types
+PARENT_TYPES = ('node', 'way', 'relation')
+PARENT_CODES = dict((tag, code) for code, tag in enumerate(PARENT_TYPES))
+
+
+class StringTable(object):
+    """
+    Maps distinct strings to integer codes in the order first seen.
+    """
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self.codes = dict((s, code) for code, s in enumerate(self.strings))
+
+    def encode(self, s):
+        """
+        Returns the code of a string, adding it to the table if it is new.
+        """
+        code = self.codes.get(s)
+        if code is None:
+            code = self.codes[s] = len(self.strings)
+            self.strings.append(s)
+        return code
+
+    def intern(self, s):
+        """
+        Returns the single string object of the table equal to s.
+        """
+        return self.strings[self.encode(s)]
+
+    def decode(self, code):
+        return self.strings[code]
+
+    def code(self, s):
+        """
+        Returns the code of a string, or -1 if it is not in the table.
+        """
+        return self.codes.get(s, -1)
+
+    def __len__(self):
+        return len(self.strings)
+
+
+# Columns of tags and of top level elements (see columns.py)
+TAG_COLUMNS = [("parent",    'b', np.int8),
+               ("parent_id", 'l', np.int64),
+               ("key",       'i', np.int32),
+               ("value",     'i', np.int32)]
+ELEMENT_COLUMNS = [("type", 'b', np.int8),
+                   ("id",   'l', np.int64),
+                   ("user", 'i', np.int32)]
+TABLES = ("keys", "values", "users")
+
+
+class TagStore(object):
+    """
+    */tag elements and users of top level elements as code arrays.
+
+    Attributes:
+        tags: A dict of arrays "parent" (code of PARENT_TYPES), "parent_id",
+              "key" and "value" (codes of keys and values tables), one per tag.
+        elements: A dict of arrays "type", "id" and "user" (code of users table),
+                  one per node, way and relation.
+        keys, values, users: StringTable objects.
+        order: Positions of tags sorted by (parent, key), stable in file order.
+        offsets: Start of each (parent, key) group in order, indexed by
+                 parent * len(keys) + key, with the end as the last item.
+    """
+    def __init__(self, tags, elements, keys, values, users, order=None, offsets=None):
+        self.tags = tags
+        self.elements = elements
+        self.keys = keys
+        self.values = values
+        self.users = users
+        if order is None or offsets is None:
+            order, offsets = self._build_key_index()
+        self.order = order
+        self.offsets = offsets
+
+    def _build_key_index(self):
+        groups = (self.tags["parent"].astype(np.int64) * len(self.keys) +
+                  self.tags["key"])
+        order = np.argsort(groups, kind="mergesort")
+        offsets = np.searchsorted(groups[order],
+                                  np.arange(len(PARENT_TYPES) * len(self.keys) + 1))
+        return order, offsets
+
+    def positions(self, path, k):
+        """
+        Returns an array of positions of */tag elements with the key k
+        in file order, read from the offset index instead of a full scan.
+        path is like "node/tag".
+        """
+        code = self.keys.code(k)
+        if code < 0:
+            return np.empty(0, dtype=self.order.dtype)
+        group = PARENT_CODES[path.split('/')[0]] * len(self.keys) + code
+        return self.order[self.offsets[group]:self.offsets[group + 1]]
+
+    def count_k(self, path):
+        """
+        Returns a list of tuples (count, k) in descending order of count.
+        path is like "node/tag".
+        """
+        start = PARENT_CODES[path.split('/')[0]] * len(self.keys)
+        counts = np.diff(self.offsets[start:start + len(self.keys) + 1])
+        return sorted([(int(counts[code]), self.keys.decode(code))
+                       for code in np.flatnonzero(counts)], reverse=True)
+
+    def count_v(self, path, k):
+        """
+        Returns a list of tuples (count, v) in descending order of count.
+        Only */tag elements with the key k are counted.
+        """
+        codes, counts = np.unique(self.tags["value"][self.positions(path, k)],
+                                  return_counts=True)
+        return sorted([(int(count), self.values.decode(code))
+                       for code, count in zip(codes, counts)], reverse=True)
+
+    def count_users(self):
+        """
+        Returns a list of tuples (count, user) of top level elements per user.
+        """
+        counts = np.bincount(self.elements["user"], minlength=len(self.users))
+        return sorted([(int(counts[code]), self.users.decode(code))
+                       for code in np.flatnonzero(counts)], reverse=True)
+
+    def save(self, directory):
+        """
+        Saves arrays as .npy files and string tables as pickles.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for group in ("tags", "elements"):
+            for name, arr in getattr(self, group).items():
+                np.save(os.path.join(directory, "%s.%s.npy" % (group, name)), arr)
+        for name in ("order", "offsets"):
+            np.save(os.path.join(directory, "index.%s.npy" % name), getattr(self, name))
+        for name in TABLES:
+            with open(os.path.join(directory, name + ".pickle"), 'wb') as f:
+                pickle.dump(getattr(self, name).strings, f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Loads a TagStore saved by save(), arrays memory-mapped by default.
+        """
+        groups = {}
+        for group, columns in (("tags", TAG_COLUMNS), ("elements", ELEMENT_COLUMNS)):
+            groups[group] = dict((name, np.load(os.path.join(directory, "%s.%s.npy" % (group, name)),
+                                                mmap_mode=mmap_mode))
+                                 for name, _, _ in columns)
+        tables = {}
+        for name in TABLES:
+            with open(os.path.join(directory, name + ".pickle"), 'rb') as f:
+                tables[name] = StringTable(pickle.load(f))
+        index = {}
+        for name in ("order", "offsets"):
+            path = os.path.join(directory, "index.%s.npy" % name)
+            if os.path.exists(path):
+                index[name] = np.load(path, mmap_mode=mmap_mode)
+        tables.update(index)
+        return cls(groups["tags"], groups["elements"], **tables)
+
+
+class TagStoreBuilder(Reducer):
+    """
+    Reducer collecting */tag elements and users of top level elements
+    into code arrays. Builders of shards are merged in file order,
+    remapping their codes into the string tables of this builder.
+    """
+    def __init__(self):
+        self.keys = StringTable()
+        self.values = StringTable()
+        self.users = StringTable()
+        self.tags = new_buffers(TAG_COLUMNS)
+        self.elements = new_buffers(ELEMENT_COLUMNS)
+
+    def visit(self, element):
+        parent = PARENT_CODES.get(element.tag)
+        if parent is None:
+            return
+        parent_id = int(element.get("id"))
+        self.elements["type"].append(parent)
+        self.elements["id"].append(parent_id)
+        self.elements["user"].append(self.users.encode(element.get("user", "")))
+        for tag in element.iter("tag"):
+            self.tags["parent"].append(parent)
+            self.tags["parent_id"].append(parent_id)
+            self.tags["key"].append(self.keys.encode(tag.get("k")))
+            self.tags["value"].append(self.values.encode(tag.get("v")))
+
+    def merge(self, other):
+        remap = {}
+        for name in TABLES:
+            table = getattr(self, name)
+            remap[name] = np.array([table.encode(s) for s in getattr(other, name).strings],
+                                   dtype=np.int32)
+        for group, columns, coded in (("tags", TAG_COLUMNS, {"key": "keys", "value": "values"}),
+                                      ("elements", ELEMENT_COLUMNS, {"user": "users"})):
+            buffers = getattr(self, group)
+            others = columns_to_numpy(getattr(other, group), columns)
+            for name, _, dtype in columns:
+                codes = others[name]
+                if name in coded:
+                    codes = remap[coded[name]][codes]
+                buffers[name].fromstring(codes.astype(dtype).tostring())
+        return self
+
+    def result(self):
+        return TagStore(columns_to_numpy(self.tags, TAG_COLUMNS),
+                        columns_to_numpy(self.elements, ELEMENT_COLUMNS),
+                        self.keys, self.values, self.users)
+
+
+def build_tag_store(osm_file, workers=1):
+    """
+    Builds a TagStore streaming over an OSM XML file.
+
+    Args:
+        osm_file: A file name of OSM XML.
+        workers: Number of processes parsing shards of the file.
+                 None uses one per CPU, 1 parses the file in this process.
+    """
+    if workers == 1:
+        builder = TagStoreBuilder()
+        for element in iter_elements(osm_file):
+            builder.visit(element)
+    else:
+        builder = map_shards(osm_file, TagStoreBuilder, workers=workers)
+    return builder.result()
@@ -0,0 +1,134 @@
+"""
+Way geometries assembled from way/nd refs and node coordinates.
+
+Refs of all ways are held in one array with offsets per way (like a CSR
+matrix) and joined to node coordinates through a binary search over the
+sorted node ids, so no dict from id to node is needed.
+"""
+from array import array
+import os
+
+import numpy as np
+
+from columns import to_numpy
+from grid_index import EARTH_RADIUS
+from osm_stream import iter_elements
+
+
+class WayStore(object):
+    """
+    Attributes:
+        id: An array of way ids.
+        offsets: Refs of way i are refs[offsets[i]:offsets[i + 1]].
+        refs: An array of node ids referred by way/nd.
+        lat, lon: Coordinates of each ref (NaN if the node does not exist).
+        length: Length of each way in meters (segments to missing nodes skipped).
+        bbox: A (number of ways, 4) array of minlat, minlon, maxlat, maxlon
+              (NaN for ways without any existing node).
+    """
+    def __init__(self, id, offsets, refs, lat=None, lon=None, length=None, bbox=None):
+        self.id = id
+        self.offsets = offsets
+        self.refs = refs
+        self.lat = lat
+        self.lon = lon
+        self.length = length
+        self.bbox = bbox
+
+    def __len__(self):
+        return len(self.id)
+
+    def geometry(self, i):
+        """
+        Returns a list of (lat, lon) of way i.
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return zip(self.lat[start:end], self.lon[start:end])
+
+    def join(self, node_id, node_lat, node_lon):
+        """
+        Looks up coordinates of refs and computes lengths and bounding boxes.
+
+        Args:
+            node_id, node_lat, node_lon: Arrays of nodes, e.g. of a NodeStore.
+        """
+        node_id = np.asarray(node_id)
+        if np.any(node_id[1:] < node_id[:-1]):
+            sort = np.argsort(node_id, kind='mergesort')
+        else:
+            sort = np.arange(len(node_id))
+        sorted_id = node_id[sort]
+        self.lat = np.full(len(self.refs), np.nan)
+        self.lon = np.full(len(self.refs), np.nan)
+        if len(sorted_id):
+            pos = np.minimum(np.searchsorted(sorted_id, self.refs), len(sorted_id) - 1)
+            found = sorted_id[pos] == self.refs
+            index = sort[pos[found]]
+            self.lat[found] = np.asarray(node_lat)[index]
+            self.lon[found] = np.asarray(node_lon)[index]
+        self._lengths()
+        self._bboxes()
+        return self
+
+    def _lengths(self):
+        la = np.radians(self.lat)
+        lo = np.radians(self.lon)
+        a = np.sin(np.diff(la) / 2) ** 2 + \
+            np.cos(la[:-1]) * np.cos(la[1:]) * np.sin(np.diff(lo) / 2) ** 2
+        segment = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+        # Segments across ways and to missing nodes are not counted
+        across = self.offsets[1:-1] - 1
+        segment[across[(across >= 0) & (across < len(segment))]] = 0.0
+        segment = np.nan_to_num(segment)
+        cumulative = np.concatenate([[0.0], np.cumsum(segment)])
+        last = len(cumulative) - 1
+        starts = np.minimum(self.offsets[:-1], last)
+        ends = np.minimum(np.maximum(self.offsets[1:] - 1, self.offsets[:-1]), last)
+        self.length = cumulative[ends] - cumulative[starts]
+
+    def _bboxes(self):
+        self.bbox = np.full((len(self.id), 4), np.nan)
+        counts = np.diff(self.offsets)
+        nonempty = np.flatnonzero(counts > 0)
+        if len(nonempty) == 0:
+            return
+        starts = self.offsets[nonempty]
+        with np.errstate(invalid='ignore'):
+            self.bbox[nonempty, 0] = np.fmin.reduceat(self.lat, starts)
+            self.bbox[nonempty, 1] = np.fmin.reduceat(self.lon, starts)
+            self.bbox[nonempty, 2] = np.fmax.reduceat(self.lat, starts)
+            self.bbox[nonempty, 3] = np.fmax.reduceat(self.lon, starts)
+
+    def save(self, directory):
+        """
+        Saves arrays as .npy files.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name in ("id", "offsets", "refs", "lat", "lon", "length", "bbox"):
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Loads a WayStore saved by save(), memory-mapped by default.
+        """
+        return cls(*[np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+                     for name in ("id", "offsets", "refs", "lat", "lon", "length", "bbox")])
+
+
+def build_way_store(osm_file):
+    """
+    Builds a WayStore of refs streaming over an OSM XML file.
+    Call join() with node arrays to assemble geometries.
+    """
+    ids = array('l')
+    offsets = array('l', [0])
+    refs = array('l')
+    for element in iter_elements(osm_file, ('way',)):
+        ids.append(int(element.get("id")))
+        for nd in element.iter("nd"):
+            refs.append(int(nd.get("ref")))
+        offsets.append(len(refs))
+    return WayStore(to_numpy(ids, np.int64), to_numpy(offsets, np.int64),
+                    to_numpy(refs, np.int64))